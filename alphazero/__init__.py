@@ -1,11 +1,30 @@
-from .connect4.game import Connect4
-from .net.net import AlphaNet
-from .net.learning import learn
-from .net.evaluating import evaluate
-from .mcts.play import self_play, run_MCTS
+import importlib
 
 from ._version import __version__
 
-__all__ = ['Connect4', 'AlphaNet', 'self_play',
+# public names -> defining module, imported on first access so that spawned
+# workers only load the modules they use
+_LAZY_IMPORTS = {'Connect4': '.connect4.game',
+                 'BitboardConnect4': '.connect4.bitboard',
+                 'VecConnect4': '.connect4.vec',
+                 'AlphaNet': '.net.net',
+                 'learn': '.net.learning',
+                 'evaluate': '.net.evaluating',
+                 'self_play': '.mcts.play',
+                 'run_MCTS': '.mcts.play'}
+
+__all__ = ['Connect4', 'BitboardConnect4', 'VecConnect4', 'AlphaNet', 'self_play',
            'run_MCTS', 'learn', 'evaluate',
            '__version__']
+
+
+def __getattr__(name):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_IMPORTS))
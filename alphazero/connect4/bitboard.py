@@ -0,0 +1,180 @@
+import numpy as np
+from ..game import Game
+from .game import Connect4, ZOBRIST_PIECES, ZOBRIST_PLAYER
+
+# bit (7 * col + height) holds the cell of column col at height rows from the
+# bottom, the 7th bit of every column stays empty so that shifts never carry
+# a line of four from one column into the next
+HEIGHT = 6
+WIDTH = 7
+BOTTOM = sum(1 << (col * (HEIGHT + 1)) for col in range(WIDTH))
+BOARD_MASK = BOTTOM * ((1 << HEIGHT) - 1)
+COLUMN_MASKS = [((1 << HEIGHT) - 1) << (col * (HEIGHT + 1)) for col in range(WIDTH)]
+SHIFTS = [1, HEIGHT + 1, HEIGHT, HEIGHT + 2]  # vertical, horizontal, \ diagonal, / diagonal
+BIT_ZOBRIST = [[ZOBRIST_PIECES[HEIGHT - 1 - bit % (HEIGHT + 1)][bit // (HEIGHT + 1)][k]
+                if bit % (HEIGHT + 1) < HEIGHT else 0 for k in range(2)]
+               for bit in range(WIDTH * (HEIGHT + 1))]
+# zobrist key of the mirrored cell: column col becomes WIDTH - 1 - col
+BIT_ZOBRIST_MIRROR = [BIT_ZOBRIST[(WIDTH - 1 - bit // (HEIGHT + 1)) * (HEIGHT + 1) + bit % (HEIGHT + 1)]
+                      for bit in range(WIDTH * (HEIGHT + 1))]
+BIT_CELLS = [(HEIGHT - 1 - bit % (HEIGHT + 1), bit // (HEIGHT + 1)) for bit in range(WIDTH * (HEIGHT + 1))]
+
+
+def has_four(bitboard):
+    for shift in SHIFTS:
+        pairs = bitboard & (bitboard >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+
+def unpack(bitboard):
+    """ Returns a 6 x 7 array of 0/1, row 0 being the top of the board """
+    bits = np.unpackbits(np.frombuffer(bitboard.to_bytes(8, "little"), dtype=np.uint8), bitorder="little")
+    return bits[:WIDTH * (HEIGHT + 1)].reshape(WIDTH, HEIGHT + 1)[:, :HEIGHT].T[::-1]
+
+
+class BitboardConnect4(Game):
+    """ Connect4 on two 64-bit bitboards, one per player, and column heights.
+
+    Same interface, encoding and position hash as Connect4, with O(1) move
+    and undo and a shift-and-mask four-in-a-row test. current_state is
+    rebuilt from the bitboards on access.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.bitboards = [0, 0]  # pieces of O and X
+        self.heights = [col * (HEIGHT + 1) for col in range(WIDTH)]  # next free bit of every column
+        self.init_state = np.full([HEIGHT, WIDTH], " ")
+        self.player = 0
+        self.zobrist_key = 0  # empty board, player 0 to move
+        self.mirror_key = 0  # zobrist key of the left-right mirrored board
+        self.planes = np.zeros([2, HEIGHT, WIDTH], dtype=np.float32)  # pieces of O and X, see encode_into
+
+        # network parameters
+        self.game_state_shape = [-1, 3, 6, 7]  # batch_size x channels x board_x x board_y
+        self.n_conv_blocks = 1
+        self.n_channels = 128
+        self.n_res_blocks = 10  # 19
+        self.game_dim = 6 * 7
+        self.action_size = 7
+
+    @property
+    def current_state(self):
+        state = np.full([HEIGHT, WIDTH], " ")
+        state[unpack(self.bitboards[0]) == 1] = "O"
+        state[unpack(self.bitboards[1]) == 1] = "X"
+        return state
+
+    @current_state.setter
+    def current_state(self, state):
+        self.bitboards = [0, 0]
+        self.heights = [col * (HEIGHT + 1) for col in range(WIDTH)]
+        if state is None:
+            return
+        for col in range(WIDTH):
+            for row in reversed(range(HEIGHT)):
+                if state[row, col] == " ":
+                    break
+                self.bitboards[0 if state[row, col] == "O" else 1] |= 1 << self.heights[col]
+                self.heights[col] += 1
+        self.refresh_planes()
+
+    def refresh_planes(self):  # after the bitboards were set directly
+        self.planes[0] = unpack(self.bitboards[0])
+        self.planes[1] = unpack(self.bitboards[1])
+
+    def encode_state(self):
+        encoded = np.zeros([6, 7, 3]).astype(int)
+        encoded[:, :, 0] = unpack(self.bitboards[0])
+        encoded[:, :, 1] = unpack(self.bitboards[1])
+        if self.player == 1:
+            encoded[:, :, 2] = 1  # player to move
+        return encoded
+
+    def encode_into(self, out):
+        out[:2] = self.planes
+        out[2] = self.player
+        return out
+
+    def decode_state(self, encoded):
+        cboard = BitboardConnect4()
+        decoded = np.full([HEIGHT, WIDTH], " ")
+        decoded[encoded[:, :, 0] == 1] = "O"
+        decoded[encoded[:, :, 1] == 1] = "X"
+        cboard.current_state = decoded
+        cboard.player = encoded[0, 0, 2]
+        cboard.zobrist_key = cboard.compute_hash()
+        cboard.mirror_key = cboard.compute_hash(mirror=True)
+        return cboard
+
+    def compute_hash(self, mirror=False):
+        zobrist = BIT_ZOBRIST_MIRROR if mirror else BIT_ZOBRIST
+        key = ZOBRIST_PLAYER if self.player == 1 else 0
+        for k in range(2):
+            bitboard = self.bitboards[k]
+            while bitboard:
+                bit = (bitboard & -bitboard).bit_length() - 1
+                key ^= zobrist[bit][k]
+                bitboard &= bitboard - 1
+        return key
+
+    def position_hash(self):
+        return self.zobrist_key
+
+    def symmetries(self):  # identity and left-right mirror
+        return [np.arange(WIDTH), np.arange(WIDTH)[::-1]]
+
+    def symmetric_hashes(self):
+        return [self.zobrist_key, self.mirror_key]
+
+    def canonical_hash(self):
+        if self.mirror_key < self.zobrist_key:
+            return self.mirror_key, 1
+        return self.zobrist_key, 0
+
+    def transform_encoded(self, encoded, k):
+        return encoded[:, ::-1] if k == 1 else encoded
+
+    def transform_batch(self, states, k):
+        return states[..., ::-1] if k == 1 else states
+
+    def legal_moves(self):
+        """ Bitmask of the cells a piece can be dropped in """
+        return ((self.bitboards[0] | self.bitboards[1]) + BOTTOM) & BOARD_MASK
+
+    def move(self, column):
+        bit = self.heights[column]
+        if not (1 << bit) & BOARD_MASK:
+            return "Invalid move"
+        self.bitboards[self.player] |= 1 << bit
+        self.heights[column] = bit + 1
+        self.planes[(self.player,) + BIT_CELLS[bit]] = 1
+        self.zobrist_key ^= BIT_ZOBRIST[bit][self.player] ^ ZOBRIST_PLAYER
+        self.mirror_key ^= BIT_ZOBRIST_MIRROR[bit][self.player] ^ ZOBRIST_PLAYER
+        self.player = 1 - self.player
+
+    def move_back(self, column):
+        return self.move(column)
+
+    def undo(self, column):
+        bit = self.heights[column] - 1
+        if bit < column * (HEIGHT + 1):
+            return "Invalid move"
+        self.player = 1 - self.player
+        self.bitboards[self.player] &= ~(1 << bit)
+        self.heights[column] = bit
+        self.planes[(self.player,) + BIT_CELLS[bit]] = 0
+        self.zobrist_key ^= BIT_ZOBRIST[bit][self.player] ^ ZOBRIST_PLAYER
+        self.mirror_key ^= BIT_ZOBRIST_MIRROR[bit][self.player] ^ ZOBRIST_PLAYER
+
+    def check_winner(self):  # True when the player who just moved has four in a row
+        if has_four(self.bitboards[1 - self.player]):
+            return True
+
+    def actions(self):  # returns all possible moves
+        legal = self.legal_moves()
+        return [col for col in range(WIDTH) if legal & COLUMN_MASKS[col]]
+
+    view_game = Connect4.view_game
@@ -1,11 +1,11 @@
 import numpy as np
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.table import Table
 from ..game import Game
 
+# zobrist keys: one per (row, column, player) piece and one for the player to move
+_zobrist = np.random.RandomState(4).randint(1, 2 ** 63, size=[6, 7, 2 + 1], dtype=np.int64)
+ZOBRIST_PIECES = [[[int(_zobrist[row, col, k]) for k in range(2)] for col in range(7)] for row in range(6)]
+ZOBRIST_PLAYER = int(_zobrist[0, 0, 2])
+
 
 class Connect4(Game):
 
@@ -15,10 +15,14 @@ class Connect4(Game):
         self.init_state[self.init_state == "0.0"] = " "
         self.current_state = self.init_state
         self.player = 0
+        self.zobrist_key = 0  # empty board, player 0 to move
+        self.mirror_key = 0  # zobrist key of the left-right mirrored board
+        self.planes = np.zeros([2, 6, 7], dtype=np.float32)  # pieces of O and X, kept in step by move and undo
 
         # network parameters
         self.game_state_shape = [-1, 3, 6, 7]  # batch_size x channels x board_x x board_y
         self.n_conv_blocks = 1
+        self.n_channels = 128
         self.n_res_blocks = 10  # 19
         self.game_dim = 6 * 7
         self.action_size = 7
@@ -35,6 +39,11 @@ class Connect4(Game):
             encoded[:, :, 2] = 1  # player to move
         return encoded
 
+    def encode_into(self, out):
+        out[:2] = self.planes
+        out[2] = self.player
+        return out
+
     def decode_state(self, encoded):
         decoded = np.zeros([6, 7]).astype(str)
         decoded[decoded == "0.0"] = " "
@@ -47,8 +56,40 @@ class Connect4(Game):
         cboard = Connect4()
         cboard.current_state = decoded
         cboard.player = encoded[0, 0, 2]
+        cboard.planes[:] = np.moveaxis(encoded[:, :, :2], 2, 0)
+        cboard.zobrist_key = cboard.compute_hash()
+        cboard.mirror_key = cboard.compute_hash(mirror=True)
         return cboard
 
+    def compute_hash(self, mirror=False):
+        key = ZOBRIST_PLAYER if self.player == 1 else 0
+        encoder_dict = {"O": 0, "X": 1}
+        for row in range(6):
+            for col in range(7):
+                if self.current_state[row, col] != " ":
+                    key ^= ZOBRIST_PIECES[row][6 - col if mirror else col][encoder_dict[self.current_state[row, col]]]
+        return key
+
+    def position_hash(self):
+        return self.zobrist_key
+
+    def symmetries(self):  # identity and left-right mirror
+        return [np.arange(7), np.arange(7)[::-1]]
+
+    def symmetric_hashes(self):
+        return [self.zobrist_key, self.mirror_key]
+
+    def canonical_hash(self):
+        if self.mirror_key < self.zobrist_key:
+            return self.mirror_key, 1
+        return self.zobrist_key, 0
+
+    def transform_encoded(self, encoded, k):
+        return encoded[:, ::-1] if k == 1 else encoded
+
+    def transform_batch(self, states, k):
+        return states[..., ::-1] if k == 1 else states
+
     def move(self, column):
         if self.current_state[0, column] != " ":
             return "Invalid move"
@@ -61,6 +102,9 @@ class Connect4(Game):
                     break
                 pos = self.current_state[row, column]
                 row += 1
+            self.zobrist_key ^= ZOBRIST_PIECES[row - 2][column][self.player] ^ ZOBRIST_PLAYER
+            self.mirror_key ^= ZOBRIST_PIECES[row - 2][6 - column][self.player] ^ ZOBRIST_PLAYER
+            self.planes[self.player, row - 2, column] = 1
             if self.player == 0:
                 self.current_state[row - 2, column] = "O"
                 self.player = 1
@@ -80,6 +124,9 @@ class Connect4(Game):
                     break
                 pos = self.current_state[row, column]
                 row += 1
+            self.zobrist_key ^= ZOBRIST_PIECES[row - 2][column][self.player] ^ ZOBRIST_PLAYER
+            self.mirror_key ^= ZOBRIST_PIECES[row - 2][6 - column][self.player] ^ ZOBRIST_PLAYER
+            self.planes[self.player, row - 2, column] = 1
             if self.player == 0:
                 self.current_state[row - 2, column] = "O"
                 self.player = 1
@@ -87,6 +134,21 @@ class Connect4(Game):
                 self.current_state[row - 2, column] = "X"
                 self.player = 0
 
+    def undo(self, column):
+        row = 0
+        while row < 6 and self.current_state[row, column] == " ":
+            row += 1
+        if row == 6:
+            return "Invalid move"
+        if self.player == 0:
+            self.player = 1
+        elif self.player == 1:
+            self.player = 0
+        self.zobrist_key ^= ZOBRIST_PIECES[row][column][self.player] ^ ZOBRIST_PLAYER
+        self.mirror_key ^= ZOBRIST_PIECES[row][6 - column][self.player] ^ ZOBRIST_PLAYER
+        self.planes[self.player, row, column] = 0
+        self.current_state[row, column] = " "
+
     def check_winner(self):
         if self.player == 1:
             for row in range(6):
@@ -178,6 +240,12 @@ class Connect4(Game):
         return acts
 
     def view_game(self, initial=False, fmt='{:s}', bkg_colors=['pink', 'pink']):
+        import pandas as pd  # plotting only, kept out of the import of the package
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib.table import Table
+
         if initial:
             np_data = self.init_state
         else:
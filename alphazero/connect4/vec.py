@@ -0,0 +1,106 @@
+import numpy as np
+import torch
+from .bitboard import BitboardConnect4, HEIGHT, WIDTH, SHIFTS
+
+_SHIFTS = [np.uint64(shift) for shift in SHIFTS]
+_ONE = np.uint64(1)
+
+
+def has_four_many(bitboards):
+    """ Vectorized bitboard.has_four over an array of uint64 bitboards """
+    found = np.zeros(bitboards.shape, dtype=bool)
+    for shift in _SHIFTS:
+        pairs = bitboards & (bitboards >> shift)
+        found |= (pairs & (pairs >> (shift + shift))) != 0
+    return found
+
+
+class VecConnect4():
+    """ num_games Connect4 boards stepped together.
+
+    The boards are kept in contiguous arrays with the BitboardConnect4
+    layout: one uint64 bitboard per game and player, the column heights and
+    the player to move. step plays one move on every board (a negative
+    action leaves a board untouched) and, with auto_reset, starts a new game
+    on the boards it finished. Players are numbered as in Connect4, 0 = O
+    moves first.
+    """
+
+    def __init__(self, num_games, auto_reset=True):
+        self.num_games = num_games
+        self.auto_reset = auto_reset
+        self.action_size = WIDTH
+        self.game_state_shape = [-1, 3, HEIGHT, WIDTH]
+        self.bitboards = np.zeros([num_games, 2], dtype=np.uint64)
+        self.heights = np.zeros([num_games, WIDTH], dtype=np.int64)
+        self.player = np.zeros([num_games], dtype=np.int64)  # player to move
+        self.num_moves = np.zeros([num_games], dtype=np.int64)
+        self._winner = np.full([num_games], -1, dtype=np.int64)  # -1 while no one has four in a row
+
+    def reset(self, games=None):
+        """ Starts new games on the boards selected by games (indices or bool mask), all by default """
+        if games is None:
+            games = slice(None)
+        self.bitboards[games] = 0
+        self.heights[games] = 0
+        self.player[games] = 0
+        self.num_moves[games] = 0
+        self._winner[games] = -1
+
+    def terminal(self):
+        return (self._winner >= 0) | (self.num_moves == HEIGHT * WIDTH)
+
+    def winner(self):  # 0 = O, 1 = X, -1 = draw or running game
+        return self._winner.copy()
+
+    def legal_mask(self):
+        """ (num_games, 7) bool array of the columns that can be played """
+        return (self.heights < HEIGHT) & ~self.terminal()[:, None]
+
+    def step(self, actions):
+        """ Plays actions[i] on board i and returns the (terminal, winner) arrays after the move.
+
+        Boards returned as terminal are reset when auto_reset is on.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        games = np.flatnonzero(actions >= 0)
+        columns = actions[games]
+        if not np.all(self.legal_mask()[games, columns]):
+            raise ValueError("Invalid move")
+        players = self.player[games]
+        bits = (columns * (HEIGHT + 1) + self.heights[games, columns]).astype(np.uint64)
+        self.bitboards[games, players] |= _ONE << bits
+        self.heights[games, columns] += 1
+        self.num_moves[games] += 1
+        won = has_four_many(self.bitboards[games, players])
+        self._winner[games[won]] = players[won]
+        self.player[games] = 1 - players
+
+        terminal, winner = self.terminal(), self.winner()
+        if self.auto_reset and terminal.any():
+            self.reset(terminal)
+        return terminal, winner
+
+    def encode(self, out=None):
+        """ (num_games, 3, 6, 7) float tensor of the boards, as Connect4.encode_state channel-first
+
+        The boards are written in out when it is given.
+        """
+        bits = np.unpackbits(self.bitboards.astype("<u8").view(np.uint8).reshape(self.num_games, 2, 8),
+                             axis=-1, bitorder="little")
+        pieces = bits[:, :, :WIDTH * (HEIGHT + 1)].reshape(self.num_games, 2, WIDTH, HEIGHT + 1)[:, :, :, :HEIGHT]
+        encoded = torch.empty([self.num_games, 3, HEIGHT, WIDTH]) if out is None else out
+        encoded[:, :2] = torch.from_numpy(np.ascontiguousarray(pieces.transpose(0, 1, 3, 2)[:, :, ::-1]))
+        encoded[:, 2] = torch.from_numpy(self.player).view(-1, 1, 1)
+        return encoded
+
+    def game(self, i):
+        """ Returns board i as a BitboardConnect4, e.g. to search it with mcts() """
+        game = BitboardConnect4()
+        game.bitboards = [int(self.bitboards[i, 0]), int(self.bitboards[i, 1])]
+        game.heights = [col * (HEIGHT + 1) + int(self.heights[i, col]) for col in range(WIDTH)]
+        game.player = int(self.player[i])
+        game.refresh_planes()
+        game.zobrist_key = game.compute_hash()
+        game.mirror_key = game.compute_hash(mirror=True)
+        return game
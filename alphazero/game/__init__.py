@@ -1 +1 @@
-from .game import Game
\ No newline at end of file
+from .game import Game, encode_many
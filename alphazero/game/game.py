@@ -1,3 +1,4 @@
+import numpy as np
 from abc import ABC, abstractmethod
 
 
@@ -13,6 +14,7 @@ class Game(ABC):
         # network parameters
         self.game_state_shape = None   # batch_size x channels x board_x x board_y
         self.n_conv_blocks = None
+        self.n_channels = None  # width of the residual tower
         self.n_res_blocks = None
         self.game_dim = None
         self.action_size = None
@@ -25,6 +27,11 @@ class Game(ABC):
     def decode_state(self, *args, **kwargs):
         pass
 
+    def encode_into(self, out):
+        """ Writes the channel-first encoding of the position in out, a float32 array """
+        out[...] = self.encode_state().transpose(2, 0, 1)
+        return out
+
     @abstractmethod
     def view_game(self, *args, **kwargs):
         pass
@@ -44,3 +51,48 @@ class Game(ABC):
     @abstractmethod
     def move_back(self, *args, **kwargs):
         pass
+
+    @abstractmethod
+    def undo(self, *args, **kwargs):  # takes back a move, so that a single board can be reused
+        pass
+
+    @abstractmethod
+    def position_hash(self, *args, **kwargs):  # hash of the position, updated incrementally by move
+        pass
+
+    # Symmetries of the board. Symmetry k maps the position to another one
+    # with the same value, and maps move a to move symmetries()[k][a];
+    # symmetry 0 is the identity. Games without symmetries keep the defaults.
+
+    def symmetries(self):
+        return [np.arange(self.action_size)]
+
+    def symmetric_hashes(self):  # position_hash of the position seen through every symmetry
+        return [self.position_hash()]
+
+    def canonical_hash(self):
+        """ Returns (hash, k): the smallest symmetric hash and the symmetry k giving it """
+        hashes = self.symmetric_hashes()
+        k = min(range(len(hashes)), key=hashes.__getitem__)
+        return hashes[k], k
+
+    def transform_encoded(self, encoded, k):  # encode_state of the position seen through symmetry k
+        return encoded
+
+    def transform_batch(self, states, k):  # transform_encoded of a batch of channel-first states (B x C x H x W)
+        return np.stack([self.transform_encoded(state.transpose(1, 2, 0), k).transpose(2, 0, 1) for state in states])
+
+    def transform_policy(self, policy, k):  # policy over the moves of the position seen through symmetry k
+        transformed = np.empty_like(policy)
+        transformed[self.symmetries()[k]] = policy
+        return transformed
+
+
+def encode_many(games, out=None):
+    """ Encodes games into the first len(games) slots of out, a float32 array or CPU tensor """
+    if out is None:
+        out = np.empty([len(games)] + list(games[0].game_state_shape[1:]), dtype=np.float32)
+    buffer = out.numpy() if hasattr(out, "numpy") else out
+    for i, game in enumerate(games):
+        game.encode_into(buffer[i])
+    return out
@@ -0,0 +1,81 @@
+import collections
+import logging
+import sys
+import torch
+from ..net.backends import TorchEvaluator
+
+
+class EvaluationCache():
+    """ Bounded LRU cache of net evaluations keyed by position hash.
+
+    Maps game.canonical_hash() to the (child priors, value) returned by the
+    net, the priors in canonical orientation (see MCTSTree). The cache
+    remembers which net and which weights filled it: sync(net) empties it
+    when it is used with another net or after the weights changed in place
+    (optimizer steps, load_state_dict). Weight updates made by another
+    process on shared-memory tensors are not detected.
+    """
+
+    ENTRY_OVERHEAD = 104  # bytes of an OrderedDict slot and its linked-list node
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.weights = None
+        self.hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+
+    @staticmethod
+    def weights_version(net):
+        if isinstance(net, TorchEvaluator):
+            net = net.net
+        if not isinstance(net, torch.nn.Module):  # e.g. an InferenceClient, whose weights live in the server
+            return id(net),
+        # every in-place update of a tensor bumps its version counter
+        return id(net), sum(p._version for p in net.parameters()), sum(b._version for b in net.buffers())
+
+    def sync(self, net):
+        weights = self.weights_version(net)
+        if weights != self.weights:
+            self.clear()
+            self.weights = weights
+
+    def clear(self):
+        self.entries.clear()
+        self.memory_bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, child_priors, value):
+        if key in self.entries:
+            return
+        entry = (child_priors, value)
+        self.entries[key] = entry
+        self.memory_bytes += self.entry_bytes(key, entry)
+        while len(self.entries) > self.max_size:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.memory_bytes -= self.entry_bytes(old_key, old_entry)
+
+    def entry_bytes(self, key, entry):
+        return (self.ENTRY_OVERHEAD + sys.getsizeof(key) + sys.getsizeof(entry)
+                + sys.getsizeof(entry[0]) + sys.getsizeof(entry[1]))
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate(), "memory_bytes": self.memory_bytes}
+
+    def report(self, name="NN cache"):
+        logging.info("%s: %d/%d entries, hit rate %.3f, %.1f MB" % (
+            name, len(self.entries), self.max_size, self.hit_rate(), self.memory_bytes / 2 ** 20))
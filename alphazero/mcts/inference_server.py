@@ -0,0 +1,162 @@
+import collections
+import logging
+import queue
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from ..net.backends import TorchEvaluator
+
+
+def inference_server_loop(net, requests, control, inputs, priors, values, events, max_batch_size, max_wait,
+                          export=False):
+    """ Body of the evaluator process, see InferenceServer """
+    torch.set_grad_enabled(False)
+    net.eval()
+    if isinstance(net, torch.nn.Module):
+        device = next(net.parameters()).device
+        if export and hasattr(net, "export_for_inference"):
+            net = net.export_for_inference(example_batch_size=max_batch_size)
+        net = TorchEvaluator(net, device)
+    batch_sizes = collections.Counter()
+    queue_depths = collections.deque(maxlen=10000)
+    latencies = collections.deque(maxlen=10000)
+    while True:
+        if control.poll():
+            command = control.recv()
+            if command == "stop":
+                break
+            if command == "stats":
+                control.send(server_stats(batch_sizes, queue_depths, latencies))
+        try:
+            request = requests.get(timeout=0.05)
+        except queue.Empty:
+            continue
+
+        # dynamic batch: wait for more requests until max_batch_size states or max_wait seconds
+        batch = [request]
+        size = request[1]
+        deadline = time.time() + max_wait
+        while size < max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += request[1]
+        try:
+            queue_depths.append(requests.qsize())
+        except NotImplementedError:  # macOS
+            pass
+
+        encoded_s = torch.cat([inputs[client, :n] for client, n, _ in batch])
+        child_priors, value_estimates = net(encoded_s)
+        offset = 0
+        for client, n, posted in batch:
+            priors[client, :n] = child_priors[offset:offset + n]
+            values[client, :n] = value_estimates[offset:offset + n]
+            offset += n
+            events[client].set()
+            latencies.append(time.time() - posted)
+        batch_sizes[size] += 1
+
+
+def server_stats(batch_sizes, queue_depths, latencies):
+    latencies = np.array(latencies) * 1000
+    return {"batches": sum(batch_sizes.values()),
+            "batch_size_histogram": dict(sorted(batch_sizes.items())),
+            "mean_batch_size": (sum(k * v for k, v in batch_sizes.items()) / max(sum(batch_sizes.values()), 1)),
+            "mean_queue_depth": float(np.mean(queue_depths)) if queue_depths else 0.0,
+            "max_queue_depth": int(np.max(queue_depths)) if queue_depths else 0,
+            "latency_ms": {"mean": float(np.mean(latencies)) if len(latencies) else 0.0,
+                           "p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                           "p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+                           "p99": float(np.percentile(latencies, 99)) if len(latencies) else 0.0}}
+
+
+class InferenceServer():
+    """ Central batched evaluator for self-play worker processes.
+
+    Each worker gets an InferenceClient, which it calls instead of the net.
+    A client owns one slot of shared-memory input and output tensors: it
+    writes its encoded states in its input slot and posts (slot, number of
+    states, time) on the request queue. The evaluator process gathers the
+    requests into a dynamic batch, bounded by max_batch_size states and
+    max_wait seconds, runs the net once and writes priors and values in the
+    output slots, which the clients read without copying. With export the
+    evaluator runs net.export_for_inference().
+    """
+
+    def __init__(self, net, num_clients, state_shape, action_size, max_batch_size=64, max_wait=0.002,
+                 client_capacity=256, export=False):
+        ctx = mp.get_context("spawn")
+        net.share_memory()
+        self.inputs = torch.zeros([num_clients, client_capacity] + list(state_shape)).share_memory_()
+        self.priors = torch.zeros([num_clients, client_capacity, action_size]).share_memory_()
+        self.values = torch.zeros([num_clients, client_capacity, 1]).share_memory_()
+        self.events = [ctx.Event() for i in range(num_clients)]
+        self.requests = ctx.Queue()
+        self.control, server_control = ctx.Pipe()
+        self.process = ctx.Process(target=inference_server_loop,
+                                   args=(net, self.requests, server_control, self.inputs, self.priors, self.values,
+                                         self.events, max_batch_size, max_wait, export),
+                                   daemon=True)
+        self.process.start()
+
+    def client(self, client_id):
+        return InferenceClient(client_id, self.requests, self.inputs, self.priors, self.values,
+                               self.events[client_id])
+
+    def stats(self):
+        self.control.send("stats")
+        return self.control.recv()
+
+    def report(self):
+        stats = self.stats()
+        logging.info("Inference server: %d batches, mean batch size %.1f, mean queue depth %.1f, "
+                     "latency mean %.2f ms p95 %.2f ms" % (
+                         stats["batches"], stats["mean_batch_size"], stats["mean_queue_depth"],
+                         stats["latency_ms"]["mean"], stats["latency_ms"]["p95"]))
+        logging.info("Inference server batch sizes: %s" % stats["batch_size_histogram"])
+        return stats
+
+    def close(self):
+        self.control.send("stop")
+        self.process.join()
+
+
+class InferenceClient():
+    """ Callable standing for the net in a worker process, see InferenceServer.
+
+    The returned priors and values are views of the shared output slot:
+    they are only valid until the next call.
+    """
+
+    def __init__(self, client_id, requests, inputs, priors, values, event):
+        self.client_id = client_id
+        self.requests = requests
+        self.inputs = inputs
+        self.priors = priors
+        self.values = values
+        self.event = event
+
+    def __call__(self, encoded_s):
+        encoded_s = encoded_s.reshape(-1, *self.inputs.shape[2:])
+        capacity = self.inputs.shape[1]
+        child_priors, value_estimates = [], []
+        for start in range(0, len(encoded_s), capacity):
+            n = min(capacity, len(encoded_s) - start)
+            self.inputs[self.client_id, :n].copy_(encoded_s[start:start + n])
+            self.event.clear()
+            self.requests.put((self.client_id, n, time.time()))
+            self.event.wait()
+            child_priors.append(self.priors[self.client_id, :n])
+            value_estimates.append(self.values[self.client_id, :n])
+            if len(encoded_s) > capacity:  # the slot is reused by the next chunk
+                child_priors[-1], value_estimates[-1] = child_priors[-1].clone(), value_estimates[-1].clone()
+        if len(child_priors) == 1:
+            return child_priors[0], value_estimates[0]
+        return torch.cat(child_priors), torch.cat(value_estimates)
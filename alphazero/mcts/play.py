@@ -5,8 +5,18 @@ import copy
 import numpy as np
 import datetime
 from ..utils.utils import load_pickle, save_as_pickle
+from ..utils.replay import ShardWriter
 from ..game.game import Game
-from .search import mcts
+import math
+from .search import mcts, search_options, gather_leaves, evaluate_leaves, backup_leaves, SearchBudget
+from .root_parallel import RootParallelMCTS
+from .cache import EvaluationCache
+from .inference_server import InferenceServer
+from .table import PositionTable, table_policy
+from .tree import MCTSTree
+from ..net.quantization import QuantizedNet, calibration_states
+from ..net.learning import self_play_student, student_checkpoint
+from ..net.backends import make_evaluator
 import torch
 import torch.multiprocessing as mp
 
@@ -26,6 +36,8 @@ def run_MCTS(args, net_class, game_class, start_idx=0, iteration=0):
 
     if args.MCTS_num_processes > 1:
         logging.info("Preparing model for multi-process MCTS...")
+        if getattr(args, "MCTS_root_workers", 1) > 1:
+            logging.warning("--MCTS_root_workers only applies with --MCTS_num_processes 1, ignored.")
         mp.set_start_method("spawn", force=True)
         net.share_memory()
         net.eval()
@@ -39,6 +51,11 @@ def run_MCTS(args, net_class, game_class, start_idx=0, iteration=0):
             torch.save({'state_dict': net.state_dict()}, os.path.join(model_data_dir, net_to_play))
             logging.info("Initialized model.")
 
+        if getattr(args, "self_play_profile", None):
+            net = self_play_student(args, net_class, game_class, iteration)
+            net.share_memory()
+        net = self_play_evaluator(args, net, game_class, iteration)  # quantized by each process that runs it
+
         processes = []
         if args.MCTS_num_processes > mp.cpu_count():
             num_processes = mp.cpu_count()
@@ -47,15 +64,29 @@ def run_MCTS(args, net_class, game_class, start_idx=0, iteration=0):
         else:
             num_processes = args.MCTS_num_processes
 
+        server = None
+        if getattr(args, "MCTS_inference_server", False):
+            logging.info("Starting inference server...")
+            server = InferenceServer(net, num_processes, game.game_state_shape[1:], game.action_size,
+                                     max_batch_size=getattr(args, "inference_max_batch_size", 64),
+                                     max_wait=getattr(args, "inference_max_wait", 0.002),
+                                     export=getattr(args, "MCTS_export_net", False))
+
         logging.info("Spawning %d processes..." % num_processes)
+        play, play_kwargs = self_play_driver(args)
         with torch.no_grad():
             for i in range(num_processes):
-                p = mp.Process(target=self_play,
-                               args=(net, game_class, args.num_games_per_MCTS_process, start_idx, i, args.temperature_MCTS, iteration))
+                p = mp.Process(target=play,
+                               args=(net if server is None else server.client(i), game_class,
+                                     args.num_games_per_MCTS_process, start_idx, i, args.temperature_MCTS, iteration),
+                               kwargs=play_kwargs)
                 p.start()
                 processes.append(p)
             for p in processes:
                 p.join()
+        if server is not None:
+            server.report()
+            server.close()
         logging.info("Finished multi-process MCTS!")
 
     elif args.MCTS_num_processes == 1:
@@ -71,20 +102,57 @@ def run_MCTS(args, net_class, game_class, start_idx=0, iteration=0):
         else:
             torch.save({'state_dict': net.state_dict()}, os.path.join(model_data_dir, net_to_play))
             logging.info("Initialized model.")
+        if getattr(args, "self_play_profile", None):
+            net = self_play_student(args, net_class, game_class, iteration)
+        net = self_play_evaluator(args, net, game_class, iteration)
+
+        play, play_kwargs = self_play_driver(args)
+        if play is not self_play and getattr(args, "MCTS_root_workers", 1) > 1:
+            logging.warning("--MCTS_root_workers does not apply to vectorized self-play (--MCTS_parallel_games), "
+                            "ignored.")
+        if play is self_play and getattr(args, "MCTS_root_workers", 1) > 1:
+            logging.info("Spawning %d root-parallel search workers..." % args.MCTS_root_workers)
+            mp.set_start_method("spawn", force=True)
+            play_kwargs["search"] = RootParallelMCTS(net, args.MCTS_root_workers)
+        elif getattr(args, "MCTS_export_net", False) and isinstance(net, torch.nn.Module):
+            logging.info("Exporting model for inference...")
+            net = net.export_for_inference(example_batch_size=getattr(args, "MCTS_batch_size", 8))
 
         with torch.no_grad():
             cpu = 0
-            self_play(net, game_class, args.num_games_per_MCTS_process, start_idx, cpu, args.temperature_MCTS, iteration)
+            play(net, game_class, args.num_games_per_MCTS_process, start_idx, cpu, args.temperature_MCTS, iteration,
+                 **play_kwargs)
+        if "search" in play_kwargs:
+            play_kwargs["search"].close()
         logging.info("Finished MCTS!")
 
 
-def self_play(net, game_class, num_games, start_idx, cpu, temperature_mcts, iteration):
+def self_play_driver(args):
+    """ Picks self_play or vectorized_self_play, and their keyword arguments, from args """
+    play_kwargs = search_options(args)
+    if getattr(args, "replay_buffer", False):
+        play_kwargs["replay_shard_size"] = getattr(args, "replay_shard_size", 4096)
+    if getattr(args, "MCTS_parallel_games", 1) > 1:
+        play_kwargs["num_parallel_games"] = args.MCTS_parallel_games
+        return vectorized_self_play, play_kwargs
+    return self_play, play_kwargs
+
+
+def self_play(net, game_class, num_games, start_idx, cpu, temperature_mcts, iteration, search=mcts,
+              replay_shard_size=None, **search_kwargs):
     logging.info("[CPU: %d]: Starting MCTS self-play..." % cpu)
 
-    if not os.path.isdir("./datasets/iter_%d" % iteration):
-        if not os.path.isdir("datasets"):
-            os.mkdir("datasets")
-        os.mkdir("datasets/iter_%d" % iteration)
+    make_dataset_dir(iteration)
+    writer = shard_writer(iteration, cpu, replay_shard_size)
+
+    cache = None
+    if search is mcts and search_kwargs.get("cache_size"):  # kept across the games of this worker
+        cache = EvaluationCache(search_kwargs.pop("cache_size"))
+        search_kwargs["cache"] = cache
+    table = None
+    if search_kwargs.get("position_table"):  # opening book and solved endgames, also consulted by the search
+        table = PositionTable(search_kwargs.pop("position_table"))
+        search_kwargs["table"] = table
 
     for idxx in tqdm(range(start_idx, num_games + start_idx)):
         logging.info("[CPU: %d]: Game %d" % (cpu, idxx))
@@ -94,18 +162,29 @@ def self_play(net, game_class, num_games, start_idx, cpu, temperature_mcts, iter
         states = []
         value = 0
         move_count = 0
+        root = None
         while checkmate == False and game.actions() != []:
             if move_count < 11:
                 t = temperature_mcts
             else:
                 t = 0.1
+            entry = table.get(game) if table is not None else None
+            if entry is not None and entry[2]:  # solved position: adjudicate the game
+                value = adjudicated_value(game, entry)
+                logging.info("[CPU: %d]: Game %d adjudicated by the position table, value %d" % (cpu, idxx, value))
+                break
             states.append(copy.deepcopy(game.current_state))
             board_state = copy.deepcopy(game.encode_state())
-            root = mcts(game, 777, net, t, 7)
-            policy = get_policy(root, t)
+            if entry is not None:  # opening book move, no search
+                policy = table_policy(entry[0], t)
+            else:
+                root = search(game, 777, net, t, 7, tree=root, **search_kwargs)
+                policy = get_policy(root, t)
             print("[CPU: %d]: Game %d POLICY:\n " % (cpu, idxx), policy)
             chosen_move = np.random.choice(np.arange(game.action_size), p=policy)
             game = do_decode_n_move_pieces(game, chosen_move)  # decode move and move piece(s)
+            if root is not None:
+                root.promote(chosen_move)  # keep the subtree of the chosen move for the next search
             dataset.append([board_state, policy])
             print("[Iteration: %d CPU: %d]: Game %d CURRENT BOARD:\n" % (iteration, cpu, idxx),
                   game.current_state, game.player)
@@ -117,17 +196,187 @@ def self_play(net, game_class, num_games, start_idx, cpu, temperature_mcts, iter
                     value = 1
                 checkmate = True
             move_count += 1
-        dataset_p = []
-        for idx, data in enumerate(dataset):
-            s, p = data
-            if idx == 0:
-                dataset_p.append([s, p, 0])
-            else:
-                dataset_p.append([s, p, value])
-        del dataset
-        save_as_pickle("iter_%d/" % iteration + \
-                       "dataset_iter%d_cpu%i_%i_%s" % (
-                           iteration, cpu, idxx, datetime.datetime.today().strftime("%Y-%m-%d")), dataset_p)
+        if cache is not None:
+            cache.report("[CPU: %d]: NN cache" % cpu)
+        save_game(dataset, value, iteration, cpu, idxx, writer)
+    if writer is not None:
+        writer.flush()
+    if table is not None:
+        table.report("[CPU: %d]: Position table" % cpu)
+
+
+def vectorized_self_play(net, game_class, num_games, start_idx, cpu, temperature_mcts, iteration,
+                         num_parallel_games=16, num_reads=777, batch_size=1, virtual_loss=1.0,
+                         transpositions=False, early_stop=False, cache_size=None, position_table=None,
+                         replay_shard_size=None, time_budget=None, num_threads=1):
+    """ Plays num_games self-play games, num_parallel_games of them in lockstep.
+
+    Every round gathers batch_size leaves from the tree of each running
+    game and evaluates all of them with a single net call. A finished game
+    is saved in the same format as self_play and its slot starts the next
+    game. The search of each move stops after num_reads reads or
+    time_budget seconds, like mcts(). The games share one thread, so
+    num_threads is ignored.
+    """
+    logging.info("[CPU: %d]: Starting vectorized MCTS self-play..." % cpu)
+    if num_threads != 1:
+        logging.warning("[CPU: %d]: Vectorized self-play ignores num_threads=%d" % (cpu, num_threads))
+    make_dataset_dir(iteration)
+    writer = shard_writer(iteration, cpu, replay_shard_size)
+    cache = EvaluationCache(cache_size) if cache_size else None
+    if cache is not None:
+        cache.sync(net)
+    table = PositionTable(position_table) if position_table else None
+
+    def play_book_moves(slot):
+        game, tree = slot["game"], slot["tree"]
+        while table is not None and game.check_winner() is not True and game.actions() != []:
+            entry = table.get(game)
+            if entry is None or entry[2]:
+                break
+            policy = table_policy(entry[0], temperature_mcts if slot["move_count"] < 11 else 0.1)
+            chosen_move = np.random.choice(np.arange(game.action_size), p=policy)
+            slot["dataset"].append([copy.deepcopy(game.encode_state()), policy])
+            game.move(chosen_move)
+            tree.promote(chosen_move)
+            slot["move_count"] += 1
+        slot["budget"] = SearchBudget(tree, num_reads, time_budget, early_stop)
+
+    def finish_game(slot):
+        """ Saves the game of slot if it is over or solved in the table, returns whether it was """
+        game = slot["game"]
+        entry = table.get(game) if table is not None else None
+        solved = entry is not None and entry[2]
+        if not (solved or game.check_winner() is True or game.actions() == []):
+            return False
+        value = 0
+        if solved:
+            value = adjudicated_value(game, entry)
+        elif game.check_winner() is True:
+            value = -1 if game.player == 0 else 1  # black / white wins
+        logging.info("[Iteration: %d CPU: %d]: Game %d finished after %d moves, value %d" % (
+            iteration, cpu, slot["idxx"], slot["move_count"], value))
+        save_game(slot["dataset"], value, iteration, cpu, slot["idxx"], writer)
+        progress.update(1)
+        return True
+
+    def start_games():  # fills the free slots, the book can finish or solve a game before any search
+        nonlocal next_idx
+        while next_idx < start_idx + num_games and len(running) < num_parallel_games:
+            game = game_class()
+            tree = MCTSTree(game, game.action_size, transpositions=transpositions)
+            slot = {"idxx": next_idx, "game": game, "tree": tree, "dataset": [], "move_count": 0}
+            next_idx += 1
+            play_book_moves(slot)
+            if not finish_game(slot):
+                running.append(slot)
+
+    next_idx = start_idx
+    running = []
+    progress = tqdm(total=num_games)
+    start_games()
+
+    # encoded leaves of all running games, reused by every round
+    buffer = torch.empty([num_parallel_games * math.ceil(batch_size)] + list(game_class().game_state_shape[1:]))
+    while running:
+        pending = []
+        num_leaves = 0
+        for slot in running:
+            tree = slot["tree"]
+            remaining = slot["budget"].remaining(int(tree.number_visits[tree.root]))
+            if remaining > 0:
+                leaves = gather_leaves(tree, math.ceil(min(batch_size, remaining)), virtual_loss, cache=cache,
+                                       out=buffer[num_leaves:], table=table)
+                pending.append((slot, leaves))
+                num_leaves += len(leaves)
+        if num_leaves > 0:
+            child_priors, value_estimates = evaluate_leaves(net, buffer[:num_leaves])
+            i = 0
+            for slot, leaves in pending:
+                backup_leaves(slot["tree"], leaves, child_priors[i:i + len(leaves)],
+                              value_estimates[i:i + len(leaves)], virtual_loss, cache)
+                i += len(leaves)
+
+        for slot in list(running):
+            game, tree = slot["game"], slot["tree"]
+            if slot["budget"].remaining(int(tree.number_visits[tree.root])) > 0:
+                continue
+            t = temperature_mcts if slot["move_count"] < 11 else 0.1
+            board_state = copy.deepcopy(game.encode_state())
+            policy = get_policy(tree, t)
+            chosen_move = np.random.choice(np.arange(game.action_size), p=policy)
+            game = do_decode_n_move_pieces(game, chosen_move)
+            tree.promote(chosen_move)
+            slot["dataset"].append([board_state, policy])
+            slot["move_count"] += 1
+            play_book_moves(slot)
+            if finish_game(slot):
+                running.remove(slot)
+                start_games()
+    progress.close()
+    if writer is not None:
+        writer.flush()
+    if cache is not None:
+        cache.report("[CPU: %d]: NN cache" % cpu)
+    if table is not None:
+        table.report("[CPU: %d]: Position table" % cpu)
+
+
+def self_play_evaluator(args, net, game_class, iteration):
+    """ What self-play runs for net, the model of iteration: an ONNX evaluator, an int8 copy or net itself """
+    if getattr(args, "evaluator_backend", "torch") == "onnx":
+        if getattr(args, "self_play_profile", None):
+            checkpoint_path = student_checkpoint(args, args.self_play_profile, iteration)
+        else:
+            checkpoint_path = os.path.join("./model_data/", "%s_iter%d.pth.tar" % (args.neural_net_name, iteration))
+        if getattr(args, "MCTS_quantize", False):
+            logging.info("--MCTS_quantize only applies to the torch backend, ignored.")
+        return make_evaluator(net, "onnx", checkpoint_path, getattr(args, "onnx_num_threads", 1))
+    if getattr(args, "MCTS_quantize", False):
+        logging.info("Quantizing model to int8...")
+        return quantized(args, net, game_class, iteration)
+    return net  # run through TorchEvaluator by the search and the inference server
+
+
+def quantized(args, net, game_class, iteration):
+    """ QuantizedNet of net calibrated on the latest self-play positions, see --MCTS_quantize """
+    calibration = calibration_states(game_class, iteration, getattr(args, "quantize_calibration_positions", 512))
+    return QuantizedNet(net, calibration)
+
+
+def make_dataset_dir(iteration):
+    if not os.path.isdir("./datasets/iter_%d" % iteration):
+        if not os.path.isdir("datasets"):
+            os.mkdir("datasets")
+        os.mkdir("datasets/iter_%d" % iteration)
+
+
+def shard_writer(iteration, cpu, shard_size):
+    """ ShardWriter of a self-play worker into datasets/iter_<iteration>, or None to pickle every game """
+    if not shard_size:
+        return None
+    return ShardWriter("./datasets/iter_%d" % iteration, "shard_iter%d_cpu%d" % (iteration, cpu), shard_size)
+
+
+def save_game(dataset, value, iteration, cpu, idxx, writer=None):
+    dataset_p = []
+    for idx, data in enumerate(dataset):
+        s, p = data
+        if idx == 0:
+            dataset_p.append([s, p, 0])
+        else:
+            dataset_p.append([s, p, value])
+    if writer is not None:  # replay buffer shards
+        writer.add_game(dataset_p, idxx)
+        return
+    save_as_pickle("iter_%d/" % iteration + \
+                   "dataset_iter%d_cpu%i_%i_%s" % (
+                       iteration, cpu, idxx, datetime.datetime.today().strftime("%Y-%m-%d")), dataset_p)
+
+
+def adjudicated_value(game: Game, entry):
+    # solved value for the player to move -> game value, +1 = white (O) wins
+    return int(entry[1]) if game.player == 0 else -int(entry[1])
 
 
 def do_decode_n_move_pieces(board: Game, chosen_move):
@@ -0,0 +1,77 @@
+import math
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from .search import mcts
+from .cache import EvaluationCache
+
+
+def root_parallel_worker(net, seed, requests, results):
+    np.random.seed(seed)  # every worker draws its own root noise
+    torch.manual_seed(seed)
+    tree = None
+    cache = None
+    with torch.no_grad():
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            if request[0] == "promote":
+                if tree is not None:
+                    tree.promote(request[1])
+                continue
+            _, game, num_reads, temp, n_children, search_kwargs = request
+            if search_kwargs.get("cache_size"):  # each worker keeps its own cache across requests
+                cache_size = search_kwargs.pop("cache_size")
+                if cache is None or cache.max_size != cache_size:
+                    cache = EvaluationCache(cache_size)
+                search_kwargs["cache"] = cache
+            if tree is None or (tree.key[tree.root], tree.symmetry[tree.root]) != game.canonical_hash():
+                tree = None
+            tree = mcts(game, num_reads, net, temp, n_children, tree=tree, **search_kwargs)
+            results.put(tree.child_number_visits)
+
+
+class RootParallelMCTS():
+    """ Root-parallel search over persistent worker processes.
+
+    Each worker runs an independent mcts() from the same root, with its own
+    noise seed and its share of the reads, and sends back only the root
+    visit counts, which are summed. Workers stay alive across moves and
+    games and keep their trees between consecutive moves (see promote).
+
+    Instances can be called like mcts() and expose the same
+    child_number_visits / promote interface as the tree it returns.
+    """
+
+    def __init__(self, net, num_workers, seed=0):
+        ctx = mp.get_context("spawn")
+        net.share_memory()
+        net.eval()
+        self.num_workers = num_workers
+        self.requests = [ctx.Queue() for i in range(num_workers)]
+        self.results = ctx.Queue()
+        self.workers = []
+        for i in range(num_workers):
+            p = ctx.Process(target=root_parallel_worker, args=(net, seed + i, self.requests[i], self.results),
+                            daemon=True)
+            p.start()
+            self.workers.append(p)
+        self.child_number_visits = None
+
+    def __call__(self, game, num_reads, net, temp, n_children, tree=None, **search_kwargs):
+        reads_per_worker = math.ceil(num_reads / self.num_workers)
+        for requests in self.requests:
+            requests.put(("search", game, reads_per_worker, temp, n_children, search_kwargs))
+        self.child_number_visits = sum(self.results.get() for i in range(self.num_workers))
+        return self
+
+    def promote(self, move):
+        for requests in self.requests:
+            requests.put(("promote", move))
+
+    def close(self):
+        for requests in self.requests:
+            requests.put(None)
+        for p in self.workers:
+            p.join()
@@ -1,25 +1,249 @@
-from .node import MCTSNode, DummyNode
+import copy
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .tree import MCTSTree
+from ..net.backends import TorchEvaluator
 from ..game.game import Game
 import torch
 
+# command line arguments forwarded as mcts() keyword arguments
+SEARCH_ARGS = {"MCTS_batch_size": "batch_size",
+               "MCTS_virtual_loss": "virtual_loss",
+               "MCTS_transpositions": "transpositions",
+               "MCTS_num_threads": "num_threads",
+               "MCTS_time_budget": "time_budget",
+               "MCTS_early_stop": "early_stop",
+               "MCTS_cache_size": "cache_size",  # turned into an EvaluationCache by self_play and arena
+               "MCTS_position_table": "position_table"}  # path opened as a PositionTable by self_play and arena
 
-def mcts(game: Game, num_reads, net, temp, n_children):
-    cuda = torch.cuda.is_available() 
-    root = MCTSNode(game, move=None, n_children=n_children, parent=DummyNode())
-    for i in range(num_reads):
-        leaf = root.select_leaf()
-        encoded_s = game.encode_state()
-        encoded_s = encoded_s.transpose(2, 0, 1)
-        if cuda:
-            encoded_s = torch.from_numpy(encoded_s).float().cuda()
-        else:
-            encoded_s = torch.from_numpy(encoded_s).float()
-        child_priors, value_estimate = net(encoded_s)
-        child_priors = child_priors.detach().cpu().numpy().reshape(-1)
-        value_estimate = value_estimate.item()
-        if leaf.game.check_winner() is True or leaf.game.actions() == []:  # if somebody won or draw
-            leaf.backup(value_estimate)
+
+def search_options(args):
+    """ Collects the optional mcts() keyword arguments set in args """
+    options = {}
+    for arg_name, kwarg_name in SEARCH_ARGS.items():
+        if getattr(args, arg_name, None) is not None:
+            options[kwarg_name] = getattr(args, arg_name)
+    return options
+
+
+def gather_leaves(tree: MCTSTree, num_leaves, virtual_loss, game=None, cache=None, out=None, table=None):
+    """ Selects num_leaves leaves, returning the ones that need a net call.
+
+    The position of every leaf is read while the board (by default the
+    scratch board of the tree) stands on it: each pending leaf is
+    (path, encoded state, legal moves). Proven, terminal, transposed and
+    cached leaves, and leaves solved in the PositionTable table, are backed
+    up on the spot without a net call.
+    The k-th pending leaf is encoded in out[k], a float tensor with room
+    for num_leaves states, so that out[:len(leaves)] is the batch to
+    evaluate; the encoded state of the leaf is a view of that slot.
+    """
+    if game is None:
+        game = tree.game
+    if out is None:
+        out = torch.empty([num_leaves] + list(game.game_state_shape[1:]))
+    buffer = out.numpy()
+    leaves = []
+    for i in range(num_leaves):
+        path = tree.select_leaf(game)
+        leaf = path[-1]
+        if not np.isnan(tree.proven_value[leaf]):  # solved subtree
+            tree.backup(path, tree.absolute_value(leaf, tree.proven_value[leaf]))
+            tree.unmake(path, game)
+            continue
+        action_idxs = game.actions()
+        won = game.check_winner() is True
+        if won or action_idxs == []:  # if somebody won or draw
+            value = 1 if won else 0  # for the mover into leaf
+            tree.prove(path, value)
+            tree.backup(path, tree.absolute_value(leaf, value))
+            tree.unmake(path, game)
+            continue
+        solved = table.solved_value(int(tree.key[leaf])) if table is not None and len(path) > 1 else None
+        if solved is not None:  # value for the player to move in leaf
+            tree.prove(path, -solved)
+            tree.backup(path, tree.absolute_value(leaf, -solved))
+            tree.unmake(path, game)
             continue
-        leaf.expand(child_priors)  # need to make sure valid moves
-        leaf.backup(value_estimate)
-    return root
+        other = tree.lookup(leaf)
+        cached = cache.get(int(tree.key[leaf])) if cache is not None and other is None else None
+        if other is not None:  # transposition: no net call needed
+            tree.link(leaf, other)
+            tree.backup(path, tree.mean_value(other))
+        elif cached is not None:
+            tree.expand(leaf, tree.from_canonical(leaf, cached[0]), action_idxs)
+            tree.backup(path, cached[1])
+        else:
+            tree.add_virtual_loss(path, virtual_loss)
+            game.encode_into(buffer[len(leaves)])
+            leaves.append((path, out[len(leaves)], action_idxs))
+        tree.unmake(path, game)
+    return leaves
+
+
+def evaluate_leaves(net, encoded_states):
+    """ Runs net on a batch tensor of encoded states, or on a list of channel-first states.
+
+    net is an evaluator (see net.backends) or a torch net, evaluated by the
+    TorchEvaluator backend.
+    """
+    if isinstance(encoded_states, torch.Tensor):
+        encoded_s = encoded_states
+    else:
+        encoded_s = torch.stack([torch.as_tensor(s, dtype=torch.float32) for s in encoded_states])
+    if isinstance(net, torch.nn.Module):
+        net = TorchEvaluator(net)
+    child_priors, value_estimates = net(encoded_s)
+    child_priors = child_priors.detach().cpu().numpy().reshape(len(encoded_states), -1)
+    value_estimates = value_estimates.detach().cpu().numpy().reshape(-1)
+    return child_priors, value_estimates
+
+
+def backup_leaves(tree: MCTSTree, leaves, child_priors, value_estimates, virtual_loss, cache=None):
+    for (path, _, action_idxs), priors, value_estimate in zip(leaves, child_priors, value_estimates):
+        if cache is not None:
+            cache.put(int(tree.key[path[-1]]), tree.to_canonical(path[-1], priors).copy(), float(value_estimate))
+        tree.revert_virtual_loss(path, virtual_loss)
+        if not tree.is_expanded(path[-1]):  # the same leaf can be gathered twice in a batch
+            tree.expand(path[-1], priors, action_idxs)  # need to make sure valid moves
+        tree.backup(path, value_estimate)
+    tree.num_evaluations += len(leaves)
+
+
+class SearchBudget():
+    """ Decides how many more reads a search may run.
+
+    The search stops once the root holds num_reads visits or after
+    time_budget seconds, whichever comes first (either can be None). With
+    early_stop it also stops as soon as the most visited root move leads
+    the runner-up by more than the reads still available. It never stops
+    before a root move has been visited, unless the game is already over.
+    """
+
+    def __init__(self, tree: MCTSTree, num_reads, time_budget=None, early_stop=False):
+        if num_reads is None and time_budget is None:
+            raise ValueError("The search needs num_reads or time_budget.")
+        self.tree = tree
+        self.num_reads = num_reads
+        self.time_budget = time_budget
+        self.early_stop = early_stop
+        self.start_time = time.time()
+        self.start_reads = int(tree.number_visits[tree.root])
+
+    def remaining(self, reads):
+        remaining = math.inf if self.num_reads is None else self.num_reads - reads
+        tree = self.tree
+        if not tree.is_expanded(tree.root) or not tree.number_visits[slice(*tree.children(tree.root))].any():
+            if tree.game.check_winner() is True or tree.game.actions() == []:  # finished game: nothing to search
+                return 0
+            return max(remaining, 1)  # the policy is read off the root's children: visit one first
+        if self.time_budget is not None:
+            elapsed = time.time() - self.start_time
+            if elapsed >= self.time_budget:
+                return 0
+            if reads > self.start_reads:  # reads that still fit in the time left at the current rate
+                remaining = min(remaining, (reads - self.start_reads) * (self.time_budget - elapsed) / elapsed)
+        if self.early_stop and remaining > 0:
+            start, stop = tree.children(tree.root)
+            if stop - start == 1:  # forced move
+                return 0
+            visits = np.sort(tree.number_visits[start:stop])
+            if visits[-1] - visits[-2] > remaining:
+                return 0
+        return remaining
+
+
+def parallel_search(tree: MCTSTree, net, batch_size, virtual_loss, num_threads, budget: SearchBudget, cache=None,
+                    table=None):
+    """ Tree-parallel search: num_threads workers descend the same tree.
+
+    Each worker walks its own copy of the root board. Selection and backup
+    hold the tree lock, while the net call runs outside of it so that the
+    workers overlap their forward passes (torch releases the GIL). Virtual
+    loss keeps concurrent workers on different paths.
+    """
+    lock = threading.Lock()
+    started = [budget.start_reads]  # reads handed out to the workers
+
+    def worker():
+        game = copy.deepcopy(tree.game)
+        buffer = torch.empty([batch_size] + list(game.game_state_shape[1:]))
+        while True:
+            with lock:
+                remaining = budget.remaining(started[0])
+                if remaining <= 0:
+                    return
+                num_leaves = math.ceil(min(batch_size, remaining))
+                started[0] += num_leaves
+                leaves = gather_leaves(tree, num_leaves, virtual_loss, game, cache, buffer, table)
+            if leaves:
+                child_priors, value_estimates = evaluate_leaves(net, buffer[:len(leaves)])
+                with lock:
+                    backup_leaves(tree, leaves, child_priors, value_estimates, virtual_loss, cache)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        workers = [executor.submit(worker) for i in range(num_threads)]
+        for w in workers:
+            w.result()  # re-raise errors of the workers
+    return tree
+
+
+def thread_scaling(game: Game, net, num_reads=777, thread_counts=(1, 2, 4, 8), **search_kwargs):
+    """ Measures simulations per second of mcts() as the number of threads rises """
+    report = []
+    for num_threads in thread_counts:
+        start = time.time()
+        with torch.no_grad():
+            mcts(game, num_reads, net, 1, game.action_size, num_threads=num_threads, **search_kwargs)
+        sims_per_second = num_reads / (time.time() - start)
+        speedup = sims_per_second / report[0][1] if report else 1.0
+        report.append((num_threads, sims_per_second, speedup))
+        logging.info("MCTS threads: %d, simulations/s: %.1f, speedup: %.2fx" % report[-1])
+    return report
+
+
+def mcts(game: Game, num_reads, net, temp, n_children, batch_size=1, virtual_loss=1.0, tree=None,
+         transpositions=False, num_threads=1, time_budget=None, early_stop=False, cache=None, table=None):
+    """ Searches game until its root holds num_reads visits.
+
+    Leaves are collected batch_size at a time, virtual loss spreads them
+    across the tree, and each batch is evaluated by a single net call.
+    A tree promoted from the previous move (see MCTSTree.promote) can be
+    passed to reuse the visits already spent below the new root.
+    With transpositions=True, positions reached by different move orders
+    share their statistics and their net evaluation (see MCTSTree).
+    With num_threads > 1 the tree is searched by parallel_search.
+    time_budget (seconds) and early_stop can end the search before
+    num_reads, see SearchBudget; num_reads can be None when a time budget
+    is given. The number of simulations run is stored in
+    tree.num_simulations.
+    An EvaluationCache passed as cache serves positions already evaluated
+    by the same weights, within and across searches.
+    Leaves found solved in a PositionTable passed as table are proven
+    without a net call.
+    """
+    if tree is None:
+        tree = MCTSTree(game, n_children, transpositions=transpositions)
+    if cache is not None:
+        cache.sync(net)
+    budget = SearchBudget(tree, num_reads, time_budget, early_stop)
+    if num_threads > 1:
+        parallel_search(tree, net, batch_size, virtual_loss, num_threads, budget, cache, table)
+    else:
+        buffer = torch.empty([batch_size] + list(game.game_state_shape[1:]))  # encoded leaves, reused by every batch
+        while True:
+            remaining = budget.remaining(int(tree.number_visits[tree.root]))
+            if remaining <= 0:
+                break
+            leaves = gather_leaves(tree, math.ceil(min(batch_size, remaining)), virtual_loss, cache=cache, out=buffer,
+                                   table=table)
+            if leaves:
+                child_priors, value_estimates = evaluate_leaves(net, buffer[:len(leaves)])
+                backup_leaves(tree, leaves, child_priors, value_estimates, virtual_loss, cache)
+    tree.num_simulations = int(tree.number_visits[tree.root]) - budget.start_reads
+    logging.debug("MCTS ran %d simulations in %.2fs" % (tree.num_simulations, time.time() - budget.start_time))
+    return tree
@@ -0,0 +1,191 @@
+import collections
+import copy
+import logging
+import numpy as np
+from .search import mcts
+
+MAGIC = b"AZPT"
+HEADER_BYTES = 32
+
+
+class PositionTable():
+    """ Read-only table of positions keyed by canonical position hash.
+
+    The file written by write_table holds, for n positions sorted by key:
+    the keys (int64), the value for the player to move (float32), the
+    policy in canonical orientation (float16, n x action_size) and a solved
+    flag (uint8). Solved entries carry the exact game-theoretic value (+1
+    win, 0 draw, -1 loss), the others come from the opening book. The file
+    is memory-mapped, so opening it costs a header read and lookups a
+    binary search touching a few pages. A pickled table reopens its file,
+    which lets it be handed to worker processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(raw[:4]) != MAGIC:
+            raise ValueError("%s is not a position table." % path)
+        n, action_size = raw[8:24].view(np.int64)
+        offset = HEADER_BYTES
+        self.keys = raw[offset:offset + 8 * n].view(np.int64)
+        offset += 8 * n
+        self.values = raw[offset:offset + 4 * n].view(np.float32)
+        offset += 4 * n
+        self.policies = raw[offset:offset + 2 * n * action_size].view(np.float16).reshape(n, action_size)
+        offset += 2 * n * action_size
+        self.solved = raw[offset:offset + n].view(np.bool_)
+        self.raw = raw
+        self.hits = collections.Counter()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def find(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def solved_value(self, key):
+        """ Exact value for the player to move of the position with canonical hash key, or None """
+        i = self.find(key)
+        if i is None or not self.solved[i]:
+            return None
+        return float(self.values[i])
+
+    def get(self, game):
+        """ Returns (policy, value for the player to move, solved) for the position of game, or None """
+        key, k = game.canonical_hash()
+        i = self.find(key)
+        if i is None:
+            return None
+        self.hits["solved" if self.solved[i] else "book"] += 1
+        policy = self.policies[i].astype(np.float32)[game.symmetries()[k]]  # back to the orientation of game
+        return policy, float(self.values[i]), bool(self.solved[i])
+
+    def report(self, name="Position table"):
+        logging.info("%s: %d positions, %d book hits, %d solved hits" % (
+            name, len(self), self.hits["book"], self.hits["solved"]))
+
+
+def write_table(path, entries, action_size):
+    """ Writes entries, a dict canonical key -> (canonical policy, value, solved), as a PositionTable file """
+    keys = np.array(sorted(entries), dtype=np.int64)
+    values = np.array([entries[key][1] for key in keys], dtype=np.float32)
+    policies = np.array([entries[key][0] for key in keys], dtype=np.float16).reshape(len(keys), action_size)
+    solved = np.array([entries[key][2] for key in keys], dtype=np.uint8)
+    header = np.zeros([HEADER_BYTES], dtype=np.uint8)
+    header[:4] = np.frombuffer(MAGIC, dtype=np.uint8)
+    header[8:24] = np.array([len(keys), action_size], dtype=np.int64).view(np.uint8)
+    with open(path, "wb") as f:
+        for array in [header, keys, values, policies, solved]:
+            f.write(array.tobytes())
+    logging.info("Wrote %d positions (%d solved) to %s" % (len(keys), int(solved.sum()), path))
+
+
+def canonical_policy(game, policy):
+    key, k = game.canonical_hash()
+    canonical = np.empty_like(policy)
+    canonical[game.symmetries()[k]] = policy
+    return key, canonical
+
+
+def solve(game, entries):
+    """ Exact negamax value of game for the player to move.
+
+    Every solved position is stored in entries with a policy spread over
+    its best moves; entries also serves as the transposition table.
+    """
+    key = game.canonical_hash()[0]
+    if key in entries and entries[key][2]:
+        return entries[key][1]
+    values = np.full([game.action_size], -np.inf, dtype=np.float32)
+    for move in game.actions():
+        game.move(move)
+        if game.check_winner() is True:
+            values[move] = 1
+        elif game.actions() == []:
+            values[move] = 0
+        else:
+            values[move] = -solve(game, entries)
+        game.undo(move)
+    best = float(values.max())
+    policy = (values == best).astype(np.float32)
+    key, policy = canonical_policy(game, policy / policy.sum())
+    entries[key] = (policy, best, True)
+    return best
+
+
+def quiet_moves(game):
+    """ Legal moves that do not end the game, or all of them if every move does """
+    moves = []
+    for move in game.actions():
+        game.move(move)
+        if game.check_winner() is not True and game.actions() != []:
+            moves.append(move)
+        game.undo(move)
+    return moves if moves else game.actions()
+
+
+def build_table(path, game_class, net=None, book_depth=4, book_reads=777, endgame_empty_cells=8,
+                endgame_games=100, seed=0, **search_kwargs):
+    """ Builds a PositionTable file with an opening book and a solved-endgame table.
+
+    The book holds every position within book_depth plies of the start
+    (mirror images once), each searched by mcts() with book_reads reads of
+    net: its policy is the root visit distribution and its value the root
+    mean value. The endgame table solves exactly the positions reached by
+    endgame_games random games (avoiding moves that end them) once at most
+    endgame_empty_cells cells are left empty, with every position met by
+    the solver.
+    """
+    np.random.seed(seed)
+    entries = {}
+    if net is not None and book_depth > 0:
+        frontier = [game_class()]
+        for depth in range(book_depth):
+            logging.info("Opening book: searching %d positions at depth %d..." % (len(frontier), depth))
+            next_frontier = []
+            for game in frontier:
+                root = mcts(game, book_reads, net, 1, game.action_size, **search_kwargs)
+                policy = root.child_number_visits / root.child_number_visits.sum()
+                value = root.mean_value(root.root)  # +1 = O wins
+                key, policy = canonical_policy(game, policy)
+                entries[key] = (policy, value if game.player == 0 else -value, False)
+                for move in game.actions():
+                    child = copy.deepcopy(game)
+                    child.move(move)
+                    if child.check_winner() is True or child.actions() == [] or \
+                            child.canonical_hash()[0] in entries:
+                        continue
+                    entries[child.canonical_hash()[0]] = None  # queued
+                    next_frontier.append(child)
+            frontier = next_frontier
+        for game in frontier:  # queued positions past the last depth
+            entries.pop(game.canonical_hash()[0])
+
+    for i in range(endgame_games):
+        game = game_class()
+        num_moves = 0
+        while game.check_winner() is not True and game.actions() != []:
+            if game.game_dim - num_moves <= endgame_empty_cells:
+                solve(game, entries)
+                break
+            game.move(np.random.choice(quiet_moves(game)))
+            num_moves += 1
+    logging.info("Endgame table: %d solved positions" % sum(entry[2] for entry in entries.values()))
+    write_table(path, entries, game_class().action_size)
+    return PositionTable(path)
+
+
+def table_policy(policy, temp=1):
+    """ Policy of a table entry at temperature temp, as get_policy does for visit counts """
+    result = policy ** (1 / temp)
+    return result / result.sum()
@@ -0,0 +1,320 @@
+import copy
+import math
+import numpy as np
+
+
+class MCTSTree():
+    """ Search tree stored as flat struct-of-arrays buffers.
+
+    Node ``i`` is described by the i-th entry of every buffer. The children of
+    an expanded node are allocated as one contiguous block starting at
+    ``first_child[i]`` and holding ``n_child[i]`` nodes (one per legal move).
+    Buffers are preallocated and grow by ``chunk_size`` nodes at a time.
+
+    With ``transpositions=True`` the tree becomes a DAG: positions reached
+    through different move orders share one children block, found through a
+    table keyed by the canonical position hash (see below). The statistics are merged as
+    follows:
+
+    * visits, values and priors of the shared children block accumulate the
+      reads coming from every path leading to the position;
+    * the visits and value of a node itself remain those of the edge leading
+      to it, so every parent still ranks its own children with its own
+      counts;
+    * a leaf found in the table is not evaluated by the network, it is linked
+      to the shared block and backed up with the mean value of the node that
+      expanded the position first.
+
+    Since a node can have several parents, backups follow the path returned
+    by ``select_leaf`` rather than the ``parent`` buffer, which only records
+    the first parent.
+
+    Keys are canonical: ``key`` holds ``game.canonical_hash()`` and
+    ``symmetry`` the board symmetry mapping the node onto its canonical
+    form, so that mirrored positions share a key. ``to_canonical`` and
+    ``from_canonical`` carry priors between the two orientations. A
+    transposition seen through a symmetry cannot share the children block
+    (its moves differ): the leaf gets its own block, with the priors of the
+    expanded node mapped through the symmetry.
+
+    The tree is also an MCTS-solver: ``proven_value`` holds the exact value
+    of a node for the player who moved into it (+1 win, 0 draw, -1 loss, NaN
+    while unknown). Terminal leaves are proven without a net call, and
+    proofs climb the selection path: a node is lost for its mover once one
+    child is won, otherwise it is proven once all its children are. Proven
+    nodes are not searched below any more, and selection never enters a
+    child lost for the player to move while another option exists.
+    """
+
+    NODE_BUFFERS = ["number_visits", "total_value", "prior", "parent",
+                    "move", "first_child", "n_child", "player", "key", "symmetry", "proven_value"]
+
+    def __init__(self, game, n_children, chunk_size=4096, transpositions=False):
+        self.n_children = n_children
+        self.chunk_size = chunk_size
+        self.transpositions = {} if transpositions else None  # (canonical hash, symmetry) -> expanded node
+        self.capacity = 0
+        self.size = 0
+        self.num_evaluations = 0  # leaves evaluated by the net
+
+        self.number_visits = np.zeros([0], dtype=np.float32)
+        self.total_value = np.zeros([0], dtype=np.float32)
+        self.prior = np.zeros([0], dtype=np.float32)
+        self.parent = np.zeros([0], dtype=np.int32)
+        self.move = np.zeros([0], dtype=np.int32)
+        self.first_child = np.zeros([0], dtype=np.int32)
+        self.n_child = np.zeros([0], dtype=np.int32)
+        self.player = np.zeros([0], dtype=np.int8)  # player to move in node
+        self.key = np.zeros([0], dtype=np.int64)  # canonical position hash, set when a node is first selected
+        self.symmetry = np.zeros([0], dtype=np.int8)  # symmetry of the board giving the canonical position
+        self.proven_value = np.zeros([0], dtype=np.float32)  # exact value for the mover into node, or NaN
+
+        # scratch board at the root position: nodes store no state, selection
+        # makes the moves of the path on it and unmake takes them back
+        self.game = copy.deepcopy(game)
+        self.symmetries = np.array(game.symmetries())  # move permutation of every symmetry
+        self.inverse_symmetries = np.argsort(self.symmetries, axis=1)
+        self.root = self.new_nodes(1, parent=-1, moves=[-1], player=game.player)
+        self.set_key(self.root, game)
+
+    def _grow(self, min_capacity):
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity += self.chunk_size
+        for name in self.NODE_BUFFERS:
+            old = getattr(self, name)
+            new = np.zeros([capacity], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def new_nodes(self, n, parent, moves, player):
+        if self.size + n > self.capacity:
+            self._grow(self.size + n)
+        start = self.size
+        stop = start + n
+        self.number_visits[start:stop] = 0
+        self.total_value[start:stop] = 0
+        self.prior[start:stop] = 0
+        self.parent[start:stop] = parent
+        self.move[start:stop] = moves
+        self.first_child[start:stop] = -1
+        self.n_child[start:stop] = 0
+        self.player[start:stop] = player
+        self.proven_value[start:stop] = np.nan
+        self.size = stop
+        return start
+
+    def set_key(self, node, game):
+        self.key[node], self.symmetry[node] = game.canonical_hash()
+
+    def to_canonical(self, node, child_priors):  # priors over the moves of node -> over the canonical moves
+        k = self.symmetry[node]
+        return child_priors if k == 0 else child_priors[self.inverse_symmetries[k]]
+
+    def from_canonical(self, node, child_priors):
+        k = self.symmetry[node]
+        return child_priors if k == 0 else child_priors[self.symmetries[k]]
+
+    def is_expanded(self, node):
+        return self.n_child[node] > 0
+
+    def children(self, node):
+        start = self.first_child[node]
+        return start, start + self.n_child[node]
+
+    def child_Q(self, node):
+        start, stop = self.children(node)
+        return self.total_value[start:stop] / (1 + self.number_visits[start:stop])
+
+    def child_U(self, node):
+        start, stop = self.children(node)
+        return math.sqrt(self.number_visits[node]) * (
+                abs(self.prior[start:stop]) / (1 + self.number_visits[start:stop]))
+
+    def best_child(self, node):
+        bestmove = self.child_Q(node) + self.child_U(node)
+        start, stop = self.children(node)
+        proven = self.proven_value[start:stop]
+        if not np.all(proven == -1):
+            bestmove[proven == -1] = -np.inf  # never walk into a proven loss
+        bestmove[proven == 1] = np.inf
+        return start + np.argmax(bestmove)
+
+    def select_leaf(self, game=None):
+        """ Walks down to a leaf, making the moves of the path on game.
+
+        game defaults to the scratch board of the tree and must be at the
+        root position; unmake(path, game) brings it back there.
+        """
+        if game is None:
+            game = self.game
+        current = self.root
+        path = [current]
+        while self.is_expanded(current) and (current == self.root or np.isnan(self.proven_value[current])):
+            current = self.best_child(current)
+            game.move(self.move[current])
+            self.set_key(current, game)
+            path.append(current)
+        return path
+
+    def unmake(self, path, game=None):
+        if game is None:
+            game = self.game
+        for node in reversed(path[1:]):
+            game.undo(self.move[node])
+
+    def add_dirichlet_noise(self, child_priors):
+        return 0.75 * child_priors + 0.25 * np.random.dirichlet(np.zeros([len(child_priors)],
+                                                                          dtype=np.float32) + 192)
+
+    def lookup(self, node):
+        """ Returns the expanded node holding the same position as node, or its mirror image, if any """
+        if self.transpositions is None:
+            return None
+        key = int(self.key[node])
+        other = self.transpositions.get((key, int(self.symmetry[node])))
+        for k in range(len(self.symmetries)):
+            if other is not None:
+                break
+            other = self.transpositions.get((key, k))
+        if other is None or other == node:
+            return None
+        return other
+
+    def link(self, node, other):
+        # share the children block of other, see the class docstring
+        if self.symmetry[node] == self.symmetry[other]:
+            self.first_child[node] = self.first_child[other]
+            self.n_child[node] = self.n_child[other]
+            return
+        start, stop = self.children(other)
+        priors = np.zeros([self.n_children], dtype=np.float32)
+        priors[self.move[start:stop]] = self.prior[start:stop]
+        moves = self.symmetries[self.symmetry[other]][self.move[start:stop]]  # canonical moves
+        moves = np.sort(self.inverse_symmetries[self.symmetry[node]][moves])
+        self.add_children(node, self.from_canonical(node, self.to_canonical(other, priors))[moves], moves)
+        self.transpositions[(int(self.key[node]), int(self.symmetry[node]))] = node
+
+    def absolute_value(self, node, value):  # value for the mover into node -> +1 = O wins
+        return value if self.player[node] == 1 else -value
+
+    def mean_value(self, node):  # value estimate of node, +1 = O wins
+        return self.absolute_value(node, self.total_value[node] / max(self.number_visits[node], 1))
+
+    def prove(self, path, value):
+        """ Stores the exact value of the leaf of path and propagates it up """
+        self.proven_value[path[-1]] = value
+        for node in reversed(path[:-1]):
+            start, stop = self.children(node)
+            proven = self.proven_value[start:stop]
+            if np.any(proven == 1):  # the player to move has a winning move
+                self.proven_value[node] = -1
+            elif not np.any(np.isnan(proven)):
+                self.proven_value[node] = -np.max(proven)
+            else:
+                break
+
+    def expand(self, node, child_priors, action_idxs):
+        other = self.lookup(node)
+        if other is not None:
+            self.link(node, other)
+            return
+        if action_idxs == []:
+            return
+        c_p = child_priors[action_idxs]  # legal moves only, illegal ones get no child
+        if node == self.root:  # add dirichlet noise to child_priors in root node
+            c_p = self.add_dirichlet_noise(c_p)
+        self.add_children(node, c_p, action_idxs)
+        if self.transpositions is not None:
+            self.transpositions[(int(self.key[node]), int(self.symmetry[node]))] = node
+
+    def add_children(self, node, priors, moves):
+        start = self.new_nodes(len(moves), parent=node, moves=moves, player=1 - self.player[node])
+        self.prior[start:start + len(moves)] = priors
+        self.first_child[node] = start
+        self.n_child[node] = len(moves)
+
+    def add_virtual_loss(self, path, virtual_loss):
+        # count a pending visit that lost for every mover on the path, so that
+        # other selections in the same batch are pushed towards other leaves
+        self.number_visits[path] += virtual_loss
+        self.total_value[path] -= virtual_loss
+
+    def revert_virtual_loss(self, path, virtual_loss):
+        self.add_virtual_loss(path, -virtual_loss)
+
+    def backup(self, path, value_estimate: float):
+        for current in path:
+            self.number_visits[current] += 1
+            if self.player[current] == 1:  # the move into current was played by 0
+                self.total_value[current] += (1 * value_estimate)  # value estimate +1 = O wins
+            elif self.player[current] == 0:
+                self.total_value[current] += (-1 * value_estimate)
+
+    def find_child(self, node, move):
+        start, stop = self.children(node)
+        for child in range(start, stop):
+            if self.move[child] == move:
+                return child
+        return None
+
+    def promote(self, move):
+        """ Makes the child reached by move the new root, keeping its subtree.
+
+        The subtree is compacted to the front of the buffers and Dirichlet
+        noise is mixed again into the priors of the new root.
+        """
+        child = self.find_child(self.root, move)
+        self.game.move(move)
+        if child is None:
+            self.__init__(self.game, self.n_children, self.chunk_size, self.transpositions is not None)
+            return
+        self.set_key(child, self.game)
+
+        order = [child]  # breadth first, so that every children block stays contiguous
+        parents = [-1]
+        blocks = set()
+        i = 0
+        while i < len(order):
+            start, stop = self.children(order[i])
+            if start not in blocks and stop > start:  # shared blocks are kept once
+                blocks.add(start)
+                order.extend(range(start, stop))
+                parents.extend([order[i]] * (stop - start))
+            i += 1
+        order = np.array(order)
+        parents = np.array(parents)
+        remap = np.full([self.size], -1, dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)
+
+        size = len(order)
+        for name in self.NODE_BUFFERS:
+            old = getattr(self, name)
+            new = np.zeros([self.capacity], dtype=old.dtype)
+            new[:size] = old[order]
+            setattr(self, name, new)
+        expanded = self.first_child[:size] >= 0
+        self.first_child[:size][expanded] = remap[self.first_child[:size][expanded]]
+        self.parent[1:size] = remap[parents[1:]]
+        self.parent[0] = -1
+        self.move[0] = -1
+        self.size = size
+        self.root = 0
+        if self.transpositions is not None:
+            self.transpositions = {(int(self.key[node]), int(self.symmetry[node])): node
+                                   for node in np.flatnonzero(self.n_child[:size] > 0)}
+
+        if self.is_expanded(self.root):
+            start, stop = self.children(self.root)
+            self.prior[start:stop] = self.add_dirichlet_noise(self.prior[start:stop])
+
+    def child_visits(self, node):
+        visits = np.zeros([self.n_children], dtype=np.float32)
+        start, stop = self.children(node)
+        visits[self.move[start:stop]] = self.number_visits[start:stop]
+        return visits
+
+    @property
+    def child_number_visits(self):
+        return self.child_visits(self.root)
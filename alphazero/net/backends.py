@@ -0,0 +1,112 @@
+import logging
+import os
+import warnings
+import numpy as np
+import torch
+from .inference import FusedAlphaNet
+
+
+class TorchEvaluator():
+    """ Evaluator running a torch net under torch.inference_mode, on the device of its weights.
+
+    Evaluators map a float tensor of encoded states (N x C x H x W) to the
+    (priors N x action_size, values N x 1) tensors. This is the torch
+    backend: evaluate_leaves and the inference server run every nn.Module
+    they are given through it, while OnnxEvaluator, QuantizedNet and
+    InferenceClient implement the same call themselves.
+    """
+
+    def __init__(self, net, device=None):
+        self.net = net
+        if device is None:
+            weights = next(net.parameters(), None)
+            if weights is not None:
+                device = weights.device
+            else:  # frozen export, see InferenceNet: its weights are constants
+                device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = device
+
+    def __call__(self, s):
+        with torch.inference_mode():
+            return self.net(s.to(self.device))
+
+
+class OnnxEvaluator():
+    """ Evaluator running an ONNX export of the net (see export_onnx) with onnxruntime on CPU.
+
+    It follows the TorchEvaluator call and can be passed to mcts(),
+    self-play and the arena in place of the net.
+    The session is opened on the first call, and a pickled evaluator only
+    carries the path of the file: worker processes never build or load the
+    torch model. Outputs are torch tensors sharing memory with the
+    onnxruntime results.
+    """
+
+    def __init__(self, path, num_threads=1):
+        self.path = path
+        self.num_threads = num_threads
+        self.session = None
+
+    def __getstate__(self):
+        return {"path": self.path, "num_threads": self.num_threads}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["num_threads"])
+
+    def open(self):
+        import onnxruntime  # optional dependency, see extras_require
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, s):
+        if self.session is None:
+            self.open()
+        if isinstance(s, torch.Tensor):
+            s = s.detach().cpu().numpy()
+        policy, value = self.session.run(None, {"states": np.ascontiguousarray(s, dtype=np.float32)})
+        return torch.from_numpy(policy), torch.from_numpy(value)
+
+    # the parts of the nn.Module interface used by self-play and the inference server
+    def eval(self):
+        return self
+
+    def share_memory(self):
+        return self
+
+
+def export_onnx(net, path, example_batch_size=8):
+    """ Writes the BatchNorm-folded net (see FusedAlphaNet) to path as an ONNX graph with a dynamic batch size """
+    fused = FusedAlphaNet(net).cpu().eval()
+    example = torch.zeros([example_batch_size] + fused.game_state_shape[1:])
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # legacy TorchScript-based exporter
+        torch.onnx.export(fused, (example,), path, input_names=["states"], output_names=["policy", "value"],
+                          dynamic_axes={"states": {0: "batch"}, "policy": {0: "batch"}, "value": {0: "batch"}},
+                          dynamo=False)
+    logging.info("Exported %s." % path)
+    return path
+
+
+def onnx_path(checkpoint_path):  # model_data/<name>_iter<i>.pth.tar -> model_data/<name>_iter<i>.onnx
+    if checkpoint_path.endswith(".pth.tar"):
+        checkpoint_path = checkpoint_path[:-len(".tar")]
+    return os.path.splitext(checkpoint_path)[0] + ".onnx"
+
+
+def export_checkpoint(net, checkpoint_path):
+    """ ONNX export of the checkpoint net was loaded from, written next to it unless an up-to-date one exists """
+    path = onnx_path(checkpoint_path)
+    if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(checkpoint_path):
+        export_onnx(net, path)
+    return path
+
+
+def make_evaluator(net, backend="torch", checkpoint_path=None, num_threads=1):
+    """ Evaluator of net (loaded from checkpoint_path) for the given backend, "torch" or "onnx" """
+    if backend == "torch":
+        return TorchEvaluator(net.eval())
+    if backend == "onnx":
+        return OnnxEvaluator(export_checkpoint(net, checkpoint_path), num_threads)
+    raise ValueError("Unknown evaluator backend %s, expected torch or onnx" % backend)
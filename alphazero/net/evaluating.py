@@ -6,8 +6,10 @@ import pickle
 import torch.multiprocessing as mp
 import datetime
 import logging
-from ..mcts.search import mcts
-from ..mcts.play import do_decode_n_move_pieces, get_policy
+from ..mcts.search import mcts, search_options
+from ..mcts.play import do_decode_n_move_pieces, get_policy, adjudicated_value, self_play_evaluator
+from ..mcts.cache import EvaluationCache
+from ..mcts.table import PositionTable, table_policy
 
 
 def save_as_pickle(filename, data):
@@ -26,10 +28,18 @@ def load_pickle(filename):
 
 
 class arena():
-    def __init__(self, current_cnet, best_cnet, game_class):
+    def __init__(self, current_cnet, best_cnet, game_class, **search_kwargs):
         self.current = current_cnet
         self.best = best_cnet
         self.game_class = game_class
+        self.search_kwargs = {"early_stop": True}  # moves are played at low temperature
+        self.search_kwargs.update(search_kwargs)
+        cache_size = self.search_kwargs.pop("cache_size", None)
+        self.caches = {"current": EvaluationCache(cache_size) if cache_size else None,
+                       "best": EvaluationCache(cache_size) if cache_size else None}
+        position_table = self.search_kwargs.pop("position_table", None)
+        self.table = PositionTable(position_table) if position_table else None  # reopened by each worker
+        self.search_kwargs["table"] = self.table
 
     def play_round(self):
         logging.info("Starting game round...")
@@ -48,21 +58,34 @@ class arena():
         dataset = []
         value = 0
         t = 0.1
+        white_root, black_root = None, None  # each net keeps its own tree across moves
         while checkmate == False and current_board.actions() != []:
+            entry = self.table.get(current_board) if self.table is not None else None
+            if entry is not None and entry[2]:  # solved position: adjudicate the game
+                value = adjudicated_value(current_board, entry)
+                print("Adjudicated by the position table: %d" % value)
+                break
             dataset.append(copy.deepcopy(current_board.encode_state()))
             print("")
             print(current_board.current_state)
-            if current_board.player == 0:
-                root = mcts(current_board, 777, white, t, 7)
-                policy = get_policy(root, t)
+            if entry is not None:  # opening book move, no search
+                policy = table_policy(entry[0], t)
+                print("Policy: ", policy, "book")
+            elif current_board.player == 0:
+                white_root = mcts(current_board, 777, white, t, 7, tree=white_root, cache=self.caches[w],
+                                  **self.search_kwargs)
+                policy = get_policy(white_root, t)
                 print("Policy: ", policy, "white = %s" % (str(w)))
             elif current_board.player == 1:
-                root = mcts(current_board, 777, black, t, 7)
-                policy = get_policy(root, t)
+                black_root = mcts(current_board, 777, black, t, 7, tree=black_root, cache=self.caches[b],
+                                  **self.search_kwargs)
+                policy = get_policy(black_root, t)
                 print("Policy: ", policy, "black = %s" % (str(b)))
-            current_board = do_decode_n_move_pieces(current_board,
-                                                    np.random.choice(np.array([0, 1, 2, 3, 4, 5, 6]),
-                                                                     p=policy))  # decode move and move piece(s)
+            chosen_move = np.random.choice(np.array([0, 1, 2, 3, 4, 5, 6]), p=policy)
+            current_board = do_decode_n_move_pieces(current_board, chosen_move)  # decode move and move piece(s)
+            for root in [white_root, black_root]:
+                if root is not None:
+                    root.promote(chosen_move)
             if current_board.check_winner() == True:  # someone wins
                 if current_board.player == 0:  # black wins
                     value = -1
@@ -93,6 +116,11 @@ class arena():
                 "evaluate_net_dataset_cpu%i_%i_%s_%s" % (cpu, i, datetime.datetime.today().strftime("%Y-%m-%d"),
                                                          str(winner)), dataset)
         print("Current_net wins ratio: %.5f" % (current_wins / num_games))
+        for name, cache in self.caches.items():
+            if cache is not None:
+                cache.report("[CPU %d]: %s net cache" % (cpu, name))
+        if self.table is not None:
+            self.table.report("[CPU %d]: Position table" % cpu)
         save_as_pickle("wins_cpu_%i" % (cpu),
                        {"best_win_ratio": current_wins / num_games, "num_games": num_games})
         logging.info("[CPU %d]: Finished arena games!" % cpu)
@@ -102,6 +130,73 @@ def fork_process(arena_obj, num_games, cpu):  # make arena picklable
     arena_obj.evaluate(num_games, cpu)
 
 
+def match(net_1, net_2, game_class, num_games=10, num_reads=100, opening_moves=2, seed=0, **search_kwargs):
+    """ Score of net_1 against net_2 (win 1, draw 0.5) over num_games with alternating colours.
+
+    Both nets search num_reads reads per move and play their most visited
+    move; the first opening_moves moves of every game are random so that
+    the games differ.
+    """
+    rng = np.random.RandomState(seed)
+    score = 0.0
+    for i in range(num_games):
+        nets = [net_1, net_2] if i % 2 == 0 else [net_2, net_1]  # nets[k] plays player k
+        game = game_class()
+        winner, num_moves = None, 0
+        while game.actions() != []:
+            if num_moves < opening_moves:
+                move = rng.choice(game.actions())
+            else:
+                root = mcts(game, num_reads, nets[game.player], 1, game.action_size, **search_kwargs)
+                move = int(np.argmax(root.child_number_visits))
+            game.move(move)
+            num_moves += 1
+            if game.check_winner() is True:
+                winner = 1 - game.player  # the player who just moved
+                break
+        if winner is None:
+            score += 0.5
+        elif nets[winner] is net_1:
+            score += 1
+    return score / num_games
+
+
+def profile_report(teacher, students, game_class, num_games=10, num_reads=100, batch_size=64, states=None):
+    """ Throughput and strength of each student (a dict name -> net) next to the teacher.
+
+    Every row holds the parameter count, the forward throughput in
+    positions/s at batch_size, the policy KL from the teacher on states
+    and the match score against the teacher.
+    """
+    from .inference import forward_time
+    device = next(teacher.parameters()).device
+    if states is None:
+        states = torch.rand([batch_size] + list(game_class().game_state_shape[1:])).round()
+    states = states.to(device)
+    teacher.eval()
+    with torch.no_grad():
+        teacher_p, _ = teacher(states)
+    report = []
+    for name, net in [("teacher", teacher)] + list(students.items()):
+        net.eval()
+        with torch.no_grad():
+            p, _ = net(states)
+        kl = (teacher_p * (torch.log(teacher_p + 1e-8) - torch.log(p + 1e-8))).sum(1).mean().item()
+        throughput = batch_size / forward_time(net, states[:batch_size])
+        score = match(net, teacher, game_class, num_games, num_reads) if net is not teacher else 0.5
+        report.append((name, sum(param.numel() for param in net.parameters()), throughput, kl, score))
+        logging.info("%s: %d parameters, %.0f positions/s, policy KL %.4f, score vs teacher %.2f" % report[-1])
+    return report
+
+
+def arena_nets(args, current_cnet, best_cnet, game_class, iteration_1, iteration_2):
+    """ What the arena runs for the loaded nets of iteration_2 and iteration_1, see self_play_evaluator """
+    args = copy.copy(args)
+    args.self_play_profile = None  # the arena plays the full nets
+    return (self_play_evaluator(args, current_cnet, game_class, iteration_2),
+            self_play_evaluator(args, best_cnet, game_class, iteration_1))
+
+
 def evaluate(args, iteration_1, iteration_2, net_class, game_class):
     logging.info("Loading nets...")
     current_net = "%s_iter%d.pth.tar" % (args.neural_net_name, iteration_2)
@@ -136,6 +231,7 @@ def evaluate(args, iteration_1, iteration_2, net_class, game_class):
         current_cnet.load_state_dict(checkpoint['state_dict'])
         checkpoint = torch.load(best_net_filename)
         best_cnet.load_state_dict(checkpoint['state_dict'])
+        current_cnet, best_cnet = arena_nets(args, current_cnet, best_cnet, game_class, iteration_1, iteration_2)
 
         processes = []
         if args.MCTS_num_processes > mp.cpu_count():
@@ -147,7 +243,8 @@ def evaluate(args, iteration_1, iteration_2, net_class, game_class):
         logging.info("Spawning %d processes..." % num_processes)
         with torch.no_grad():
             for i in range(num_processes):
-                p = mp.Process(target=fork_process, args=(arena(current_cnet, best_cnet, game_class), args.num_evaluator_games, i))
+                p = mp.Process(target=fork_process, args=(arena(current_cnet, best_cnet, game_class, **search_options(args)),
+                                                          args.num_evaluator_games, i))
                 p.start()
                 processes.append(p)
             for p in processes:
@@ -170,7 +267,9 @@ def evaluate(args, iteration_1, iteration_2, net_class, game_class):
         current_cnet.load_state_dict(checkpoint['state_dict'])
         checkpoint = torch.load(best_net_filename)
         best_cnet.load_state_dict(checkpoint['state_dict'])
-        arena1 = arena(current_cnet=current_cnet, best_cnet=best_cnet, game_class=game_class)
+        current_cnet, best_cnet = arena_nets(args, current_cnet, best_cnet, game_class, iteration_1, iteration_2)
+        arena1 = arena(current_cnet=current_cnet, best_cnet=best_cnet, game_class=game_class,
+                       **search_options(args))
         arena1.evaluate(num_games=args.num_evaluator_games, cpu=0)
 
         stats = load_pickle("wins_cpu_%i" % (0))
@@ -0,0 +1,109 @@
+import copy
+import logging
+import time
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+class FusedAlphaNet(nn.Module):
+    """ AlphaNet for inference: BatchNorm folded into the convolutions.
+
+    Computes the same (policy, value) as AlphaNet in eval mode, with a
+    softmax in place of logsoftmax().exp() and the input reshaped once.
+    """
+
+    def __init__(self, net):
+        super().__init__()
+        net = copy.deepcopy(net).eval()
+        self.game_state_shape = list(net.game_state_shape)
+        self.game_dim = net.game_dim
+        self.n_res_blocks = net.n_res_blocks
+        self.conv = fuse_conv_bn_eval(net.conv.conv1, net.conv.bn1)
+        self.res_convs = nn.ModuleList()
+        for block in range(self.n_res_blocks):
+            res = getattr(net, "res_%i" % block)
+            self.res_convs.append(nn.ModuleList([fuse_conv_bn_eval(res.conv1, res.bn1),
+                                                 fuse_conv_bn_eval(res.conv2, res.bn2)]))
+        out = net.outblock
+        self.value_conv = fuse_conv_bn_eval(out.conv, out.bn)
+        self.value_fc1, self.value_fc2 = out.fc1, out.fc2
+        self.policy_conv = fuse_conv_bn_eval(out.conv1, out.bn1)
+        self.policy_fc = out.fc
+
+    def forward(self, s):
+        s = F.relu(self.conv(s.reshape(self.game_state_shape)))
+        for conv1, conv2 in self.res_convs:
+            s = F.relu(conv2(F.relu(conv1(s))) + s)
+
+        v = F.relu(self.value_conv(s)).flatten(1)  # NCHW order, whatever the memory format
+        v = torch.tanh(self.value_fc2(F.relu(self.value_fc1(v))))
+        p = F.relu(self.policy_conv(s)).flatten(1)
+        p = torch.softmax(self.policy_fc(p), dim=1)
+        return p, v
+
+
+class InferenceNet(nn.Module):
+    """ Runs an exported AlphaNet under torch.inference_mode, see AlphaNet.export_for_inference """
+
+    def __init__(self, module, game_state_shape, channels_last):
+        super().__init__()
+        self.module = module
+        self.game_state_shape = game_state_shape
+        self.channels_last = channels_last
+
+    def forward(self, s):
+        with torch.inference_mode():
+            if self.channels_last:
+                s = s.reshape(self.game_state_shape).contiguous(memory_format=torch.channels_last)
+            return self.module(s)
+
+
+def export_for_inference(net, channels_last=None, trace=True, example_batch_size=8):
+    if channels_last is None:  # keep the faster layout at example_batch_size
+        candidates = [export_for_inference(net, layout, trace, example_batch_size) for layout in [False, True]]
+        s = torch.rand([example_batch_size] + list(net.game_state_shape[1:]), device=next(net.parameters()).device)
+        return min(candidates, key=lambda candidate: forward_time(candidate, s))
+
+    fused = FusedAlphaNet(net).eval()
+    device = next(net.parameters()).device
+    if channels_last:
+        fused = fused.to(memory_format=torch.channels_last)
+    module = fused
+    if trace:
+        example = torch.zeros([example_batch_size] + fused.game_state_shape[1:], device=device)
+        if channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)  # torch.jit is deprecated in recent releases
+            module = torch.jit.freeze(torch.jit.trace(fused, example))
+    return InferenceNet(module, fused.game_state_shape, channels_last).eval()
+
+
+def forward_time(net, s, repeats=10):
+    """ Median time in seconds of net(s) """
+    times = []
+    with torch.no_grad():
+        net(s)  # warm-up
+        for i in range(repeats):
+            start = time.time()
+            net(s)
+            times.append(time.time() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def latency_table(net, batch_sizes=(1, 2, 4, 8, 16, 32, 64, 128), repeats=30, exported=None):
+    """ Median forward latency in ms of net and of its exported version, by batch size """
+    if exported is None:
+        exported = net.export_for_inference()
+    net.eval()
+    device = next(net.parameters()).device
+    report = []
+    for batch_size in batch_sizes:
+        s = torch.rand([batch_size] + list(net.game_state_shape[1:]), device=device)
+        eager, fused = forward_time(net, s, repeats) * 1000, forward_time(exported, s, repeats) * 1000
+        report.append((batch_size, eager, fused, eager / fused))
+        logging.info("Batch %4d: eager %.2f ms, exported %.2f ms, speedup %.2fx" % report[-1])
+    return report
@@ -1,16 +1,17 @@
 import os
 import pickle
 import datetime
+import time
 import numpy as np
 import torch
 import torch.optim as optim
 from torch.utils.data import DataLoader
 from torch.nn.utils import clip_grad_norm_
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import logging
-from .net import AlphaDataset, AlphaLoss
+from .net import AlphaDataset, AlphaLoss, ReplayDataset, ReplayStream
+from .quantization import calibration_states
+from .backends import export_checkpoint
+from ..utils.replay import ReplayBuffer
 
 
 def save_as_pickle(filename, data):
@@ -57,14 +58,79 @@ def load_results(iteration):
     return losses_per_epoch
 
 
-def train(net, dataset, optimizer, scheduler, start_epoch, cpu, args, iteration):
+def training_step_net(net, args):
+    """ The module train() calls: net, or with --fast_train its torch.compile'd version when available """
+    if getattr(args, "fast_train", False) and getattr(args, "train_compile", True) and hasattr(torch, "compile"):
+        logging.info("Compiling training step...")
+        return torch.compile(net)
+    return net
+
+
+def autocast(args, cuda):
+    """ bfloat16 autocast context of --fast_train, a no-op otherwise """
+    enabled = getattr(args, "fast_train", False) and getattr(args, "train_bf16", True)
+    return torch.autocast("cuda" if cuda else "cpu", dtype=torch.bfloat16, enabled=enabled)
+
+
+def training_step(step_net, criterion, state, policy, value, args, cuda):
+    """ Forward and backward pass of one batch, returns (policy_pred, value_pred, loss) """
+    fast = getattr(args, "fast_train", False)
+    with autocast(args, cuda):
+        policy_pred, value_pred = step_net(
+            state, log_policy=fast)  # policy_pred = torch.Size([batch, 4672]) value_pred = torch.Size([batch, 1])
+    loss = criterion(value_pred[:, 0].float(), value, policy_pred.float(), policy, log_policy=fast)
+    loss = loss / args.gradient_acc_steps
+    loss.backward()
+    return policy_pred, value_pred, loss
+
+
+def training_throughput(net, args, num_batches=20, warmup=3):
+    """ Samples per second of the training loop of args (eager or --fast_train) on random batches """
+    cuda = next(net.parameters()).is_cuda
+    net.train()
+    step_net = training_step_net(net, args)
+    criterion = AlphaLoss()
+    optimizer = optim.Adam(net.parameters(), lr=args.lr, betas=(0.8, 0.999))
+    state = torch.rand([args.batch_size] + list(net.game_state_shape[1:])).round()
+    policy = torch.softmax(torch.rand(args.batch_size, net.action_size), 1)
+    value = torch.rand(args.batch_size) * 2 - 1
+    if cuda:
+        state, policy, value = state.cuda(), policy.cuda(), value.cuda()
+    total_loss = 0.0
+    for i in range(warmup + num_batches):
+        if i == warmup:  # after compilation
+            float(total_loss)
+            start = time.time()
+        loss = training_step(step_net, criterion, state, policy, value, args, cuda)[2]
+        clip_grad_norm_(net.parameters(), args.max_norm)
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        total_loss += loss.detach() if getattr(args, "fast_train", False) else loss.item()
+    float(total_loss)
+    return num_batches * args.batch_size / (time.time() - start)
+
+
+def train(net, dataset, optimizer, scheduler, start_epoch, cpu, args, iteration, game=None):
     torch.manual_seed(cpu)
     cuda = torch.cuda.is_available()
     net.train()
     criterion = AlphaLoss()
+    # --fast_train: compiled bf16 step, loss on log-probabilities, no host sync per batch
+    fast = getattr(args, "fast_train", False)
+    step_net = training_step_net(net, args)
 
-    train_set = AlphaDataset(dataset)
-    train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=0, pin_memory=False)
+    num_workers = getattr(args, "num_loader_workers", 0)
+    if isinstance(dataset, ReplayBuffer) and getattr(args, "replay_stream", False):  # pre-collated batches
+        train_set = ReplayStream(dataset, args.batch_size, game, seed=cpu, num_workers=num_workers)
+        train_loader = DataLoader(train_set, batch_size=None, num_workers=num_workers, pin_memory=cuda)
+    else:
+        if isinstance(dataset, ReplayBuffer):
+            train_set = ReplayDataset(dataset, game)
+        else:
+            train_set = AlphaDataset(dataset, game)  # random symmetries of the samples if game is given
+        train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=num_workers,
+                                  pin_memory=False)
+    num_samples = len(dataset)
     losses_per_epoch = load_results(iteration + 1)
 
     logging.info("Starting training process...")
@@ -73,28 +139,29 @@ def train(net, dataset, optimizer, scheduler, start_epoch, cpu, args, iteration)
     for epoch in range(start_epoch, args.num_epochs):
         total_loss = 0.0
         losses_per_batch = []
+        epoch_start = time.time()
+        if isinstance(train_set, ReplayStream):
+            train_set.set_epoch(epoch)
         for i, data in enumerate(train_loader, 0):
             state, policy, value = data
             state, policy, value = state.float(), policy.float(), value.float()
             if cuda:
                 state, policy, value = state.cuda(), policy.cuda(), value.cuda()
-            policy_pred, value_pred = net(
-                state)  # policy_pred = torch.Size([batch, 4672]) value_pred = torch.Size([batch, 1])
-            loss = criterion(value_pred[:, 0], value, policy_pred, policy)
-            loss = loss / args.gradient_acc_steps
-            loss.backward()
+            policy_pred, value_pred, loss = training_step(step_net, criterion, state, policy, value, args, cuda)
             clip_grad_norm_(net.parameters(), args.max_norm)
             if (epoch % args.gradient_acc_steps) == 0:
                 optimizer.step()
-                optimizer.zero_grad()
+                optimizer.zero_grad(set_to_none=True)
 
-            total_loss += loss.item()
+            total_loss += loss.detach() if fast else loss.item()  # read back every update_size batches only
             if update_size == 0:
                 update_size = 1
             if i % update_size == (update_size - 1):  # print every update_size-d mini-batches of size = batch_size
-                losses_per_batch.append(args.gradient_acc_steps * total_loss / update_size)
+                if fast:
+                    policy_pred = policy_pred.float().exp()
+                losses_per_batch.append(args.gradient_acc_steps * float(total_loss) / update_size)
                 print('[Iteration %d] Process ID: %d [Epoch: %d, %5d/ %d points] total loss per batch: %.3f' %
-                      (iteration, os.getpid(), epoch + 1, (i + 1) * args.batch_size, len(train_set),
+                      (iteration, os.getpid(), epoch + 1, (i + 1) * args.batch_size, num_samples,
                        losses_per_batch[-1]))
                 print("Policy (actual, predicted):", policy[0].argmax().item(), policy_pred[0].argmax().item())
                 print("Policy data:", policy[0])
@@ -104,6 +171,8 @@ def train(net, dataset, optimizer, scheduler, start_epoch, cpu, args, iteration)
                 # print("Res18 grad %.7f:" % net.res_18.conv1.weight.grad.mean().item())
                 print(" ")
                 total_loss = 0.0
+        logging.info("[Iteration %d] Epoch %d: %.0f samples/s" % (
+            iteration, epoch + 1, num_samples / (time.time() - epoch_start)))
 
         scheduler.step()
         if len(losses_per_batch) >= 1:
@@ -124,6 +193,10 @@ def train(net, dataset, optimizer, scheduler, start_epoch, cpu, args, iteration)
                 break
         '''
     logging.info("Finished Training!")
+    import matplotlib  # plotting only, kept out of the import of the package
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
     fig = plt.figure()
     ax = fig.add_subplot(222)
     ax.scatter([e for e in range(start_epoch, (len(losses_per_epoch) + start_epoch))], losses_per_epoch)
@@ -138,14 +211,18 @@ def train(net, dataset, optimizer, scheduler, start_epoch, cpu, args, iteration)
 def learn(args, net_class, game_class, iteration, new_optim_state):
     # gather data
     logging.info("Loading training data...")
-    data_path = "./datasets/iter_%d/" % iteration
-    datasets = []
-    for idx, file in enumerate(os.listdir(data_path)):
-        filename = os.path.join(data_path, file)
-        with open(filename, 'rb') as fo:
-            datasets.extend(pickle.load(fo, encoding='bytes'))
-    datasets = np.array(datasets)
-    logging.info("Loaded data from %s." % data_path)
+    if getattr(args, "replay_buffer", False):  # memory-mapped shards of the last replay_window iterations
+        datasets = ReplayBuffer(iteration, getattr(args, "replay_window", 1))
+        datasets.report()
+    else:
+        data_path = "./datasets/iter_%d/" % iteration
+        datasets = []
+        for idx, file in enumerate(os.listdir(data_path)):
+            filename = os.path.join(data_path, file)
+            with open(filename, 'rb') as fo:
+                datasets.extend(pickle.load(fo, encoding='bytes'))
+        datasets = np.array(datasets)
+        logging.info("Loaded data from %s." % data_path)
 
     # train net
     cuda = torch.cuda.is_available()
@@ -156,4 +233,85 @@ def learn(args, net_class, game_class, iteration, new_optim_state):
     scheduler = optim.lr_scheduler.MultiStepLR(optimizer, milestones=[50, 100, 150, 200, 250, 300, 400], gamma=0.77)
     start_epoch = load_state(net, optimizer, scheduler, args, iteration, new_optim_state)
 
-    train(net, datasets, optimizer, scheduler, start_epoch, 0, args, iteration)
+    game = game_class() if getattr(args, "augment_symmetries", False) else None
+    train(net, datasets, optimizer, scheduler, start_epoch, 0, args, iteration, game)
+
+    if getattr(args, "evaluator_backend", "torch") == "onnx":  # export the new checkpoint for self-play workers
+        checkpoint_path = os.path.join("./model_data/", "%s_iter%d.pth.tar" % (args.neural_net_name, iteration + 1))
+        net.load_state_dict(torch.load(checkpoint_path)['state_dict'])
+        export_checkpoint(net, checkpoint_path)
+
+
+def student_checkpoint(args, profile, iteration):
+    return os.path.join("./model_data/", "%s_%s_iter%d.pth.tar" % (args.neural_net_name, profile, iteration))
+
+
+def distill(teacher, student, states, num_epochs=10, batch_size=64, lr=0.001):
+    """ Trains student to match the policy and value of teacher on states (N x C x H x W).
+
+    Returns the policy KL(teacher || student), the value MSE and the share
+    of states where both nets prefer the same move, after training.
+    """
+    device = next(student.parameters()).device
+    teacher.eval()
+    with torch.no_grad():
+        targets = [teacher(states[start:start + batch_size].to(device)) for start in range(0, len(states), batch_size)]
+    target_p = torch.cat([p for p, v in targets])
+    target_v = torch.cat([v for p, v in targets])[:, 0]
+    states = states.to(device)
+
+    criterion = AlphaLoss()
+    optimizer = optim.Adam(student.parameters(), lr=lr, betas=(0.8, 0.999))
+    student.train()
+    for epoch in range(num_epochs):
+        total_loss = 0.0
+        for idx in torch.randperm(len(states), device=device).split(batch_size):
+            policy_pred, value_pred = student(states[idx])
+            loss = criterion(value_pred[:, 0], target_v[idx], policy_pred, target_p[idx])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(idx)
+        logging.info("Distillation epoch %d: loss %.4f" % (epoch + 1, total_loss / len(states)))
+
+    student.eval()
+    with torch.no_grad():
+        p, v = student(states)
+    kl = (target_p * (torch.log(target_p + 1e-8) - torch.log(p + 1e-8))).sum(1).mean().item()
+    return {"policy_kl": kl, "value_mse": ((target_v - v[:, 0]) ** 2).mean().item(),
+            "top1_agreement": (target_p.argmax(1) == p.argmax(1)).float().mean().item()}
+
+
+def self_play_student(args, net_class, game_class, iteration):
+    """ The args.self_play_profile net self-play runs at iteration.
+
+    Loaded from its checkpoint, or distilled from the teacher checkpoint of
+    the iteration on the latest self-play positions (warm-started from the
+    student of the previous iteration) and saved.
+    """
+    profile = args.self_play_profile
+    student = net_class(game_class(), profile=profile)
+    if torch.cuda.is_available():
+        student.cuda()
+    checkpoint_path = student_checkpoint(args, profile, iteration)
+    if os.path.isfile(checkpoint_path):
+        student.load_state_dict(torch.load(checkpoint_path)['state_dict'])
+        logging.info("Loaded %s student model." % checkpoint_path)
+        return student.eval()
+
+    teacher = net_class(game_class())
+    if torch.cuda.is_available():
+        teacher.cuda()
+    teacher.load_state_dict(torch.load(os.path.join(
+        "./model_data/", "%s_iter%d.pth.tar" % (args.neural_net_name, iteration)))['state_dict'])
+    if os.path.isfile(student_checkpoint(args, profile, iteration - 1)):
+        student.load_state_dict(torch.load(student_checkpoint(args, profile, iteration - 1))['state_dict'])
+    states = calibration_states(game_class, iteration, getattr(args, "distill_positions", 4096),
+                                num_iterations=getattr(args, "distill_iterations", 2))
+    logging.info("Distilling %s student from the iteration %d model..." % (profile, iteration))
+    stats = distill(teacher, student, states, getattr(args, "distill_epochs", 10), args.batch_size, args.lr)
+    logging.info("Distilled %s student: policy KL %.4f, value MSE %.4f, top-1 agreement %.3f" % (
+        profile, stats["policy_kl"], stats["value_mse"], stats["top1_agreement"]))
+    torch.save({'state_dict': student.state_dict(), 'profile': student.profile(), 'teacher_iteration': iteration},
+               checkpoint_path)
+    return student
@@ -1,44 +1,69 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.utils.data import Dataset
-import matplotlib
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 import numpy as np
 from ..game import Game
 
-matplotlib.use("Agg")
+
+# width (channels of the residual tower) and depth (residual blocks) of AlphaNet
+MODEL_PROFILES = {"tiny": {"n_channels": 32, "n_res_blocks": 2},
+                  "small": {"n_channels": 64, "n_res_blocks": 4},
+                  "standard": {"n_channels": 128, "n_res_blocks": 10},
+                  "large": {"n_channels": 128, "n_res_blocks": 19}}
 
 
 class AlphaNet(nn.Module):
+    """ Residual policy/value net. Width and depth come from the game
+    (n_channels, n_res_blocks) unless profile, a name of MODEL_PROFILES or a
+    dict with either key, overrides them.
+    """
 
-    def __init__(self, game: Game):
+    def __init__(self, game: Game, profile=None):
         super().__init__()
+        if isinstance(profile, str):
+            if profile not in MODEL_PROFILES:
+                raise ValueError("Unknown model profile %s, expected one of %s" % (profile, list(MODEL_PROFILES)))
+            profile = MODEL_PROFILES[profile]
+        profile = profile or {}
 
         self.game_state_shape = game.game_state_shape
         self.n_conv_blocks = game.n_conv_blocks
-        self.n_res_blocks = game.n_res_blocks
+        self.n_channels = profile.get("n_channels", getattr(game, "n_channels", None) or 128)
+        self.n_res_blocks = profile.get("n_res_blocks", game.n_res_blocks)
         self.game_dim = game.game_dim
         self.action_size = game.action_size
 
+        self.conv = ConvBlock(self.action_size, self.game_state_shape, self.n_channels)
         for block in range(self.n_res_blocks):
-            self.conv = ConvBlock(self.action_size, self.game_state_shape)
-        for block in range(self.n_res_blocks):
-            setattr(self, "res_%i" % block, ResBlock())
-        self.outblock = OutBlock(self.game_dim, self.action_size)
+            setattr(self, "res_%i" % block, ResBlock(self.n_channels, self.n_channels))
+        self.outblock = OutBlock(self.game_dim, self.action_size, self.n_channels)
 
-    def forward(self, s):
+    def profile(self):
+        return {"n_channels": self.n_channels, "n_res_blocks": self.n_res_blocks}
+
+    def forward(self, s, log_policy=False):  # log_policy: log-probabilities, for AlphaLoss(log_policy=True)
         s = self.conv(s)
         for block in range(self.n_res_blocks):
             s = getattr(self, "res_%i" % block)(s)
-        s = self.outblock(s)
+        s = self.outblock(s, log_policy)
         return s
 
+    def export_for_inference(self, channels_last=None, trace=True, example_batch_size=8):
+        """ Returns a frozen inference copy of the net: BatchNorm folded into the
+        convolutions, traced with torch.jit and run under torch.inference_mode.
+        channels_last=None keeps whichever memory layout runs faster. See
+        net.inference.latency_table for its speed.
+        """
+        from .inference import export_for_inference
+        return export_for_inference(self, channels_last, trace, example_batch_size)
+
 
 class ConvBlock(nn.Module):
-    def __init__(self, action_size, reshape_size):
+    def __init__(self, action_size, reshape_size, planes=128):
         super(ConvBlock, self).__init__()
-        self.conv1 = nn.Conv2d(3, 128, 3, stride=1, padding=1)
-        self.bn1 = nn.BatchNorm2d(128)
+        self.conv1 = nn.Conv2d(reshape_size[1], planes, 3, stride=1, padding=1)
+        self.bn1 = nn.BatchNorm2d(planes)
         self.action_size = action_size
         self.reshape_size = reshape_size
 
@@ -72,22 +97,22 @@ class ResBlock(nn.Module):
 
 class OutBlock(nn.Module):
 
-    def __init__(self, game_dim, action_size):
+    def __init__(self, game_dim, action_size, inplanes=128):
         super(OutBlock, self).__init__()
         self.game_dim = game_dim
         self.action_size = action_size
 
-        self.conv = nn.Conv2d(128, 3, kernel_size=1)  # value head
+        self.conv = nn.Conv2d(inplanes, 3, kernel_size=1)  # value head
         self.bn = nn.BatchNorm2d(3)
         self.fc1 = nn.Linear(3 * self.game_dim, 32)
         self.fc2 = nn.Linear(32, 1)
 
-        self.conv1 = nn.Conv2d(128, 32, kernel_size=1)  # policy head
+        self.conv1 = nn.Conv2d(inplanes, 32, kernel_size=1)  # policy head
         self.bn1 = nn.BatchNorm2d(32)
         self.logsoftmax = nn.LogSoftmax(dim=1)
         self.fc = nn.Linear(self.game_dim * 32, self.action_size)
 
-    def forward(self, s):
+    def forward(self, s, log_policy=False):
         v = F.relu(self.bn(self.conv(s)))  # value head
         v = v.view(-1, 3 * self.game_dim)  # batch_size X channel X height X width
         v = F.relu(self.fc1(v))
@@ -95,9 +120,8 @@ class OutBlock(nn.Module):
 
         p = F.relu(self.bn1(self.conv1(s)))  # policy head
         p = p.view(-1, self.game_dim * 32)
-        p = self.fc(p)
-        p = self.logsoftmax(p).exp()
-        return p, v
+        p = self.logsoftmax(self.fc(p))
+        return (p if log_policy else p.exp()), v
 
 
 class AlphaLoss(torch.nn.Module):
@@ -105,22 +129,119 @@ class AlphaLoss(torch.nn.Module):
     def __init__(self):
         super(AlphaLoss, self).__init__()
 
-    def forward(self, y_value, value, y_policy, policy):
+    def forward(self, y_value, value, y_policy, policy, log_policy=False):
         value_error = (value - y_value) ** 2
-        policy_error = torch.sum((-policy *
-                                  (1e-8 + y_policy.float()).float().log()), 1)
+        if log_policy:  # y_policy holds log-probabilities straight from the logits
+            policy_error = torch.sum(-policy * y_policy.float(), 1)
+        else:
+            policy_error = torch.sum((-policy *
+                                      (1e-8 + y_policy.float()).float().log()), 1)
         total_error = (value_error.view(-1).float() + policy_error).mean()
         return total_error
 
 
 class AlphaDataset(Dataset):
 
-    def __init__(self, dataset):  # dataset = np.array of (s, p, v)
+    def __init__(self, dataset, game: Game = None):  # dataset = np.array of (s, p, v)
         self.X = dataset[:, 0]
         self.y_p, self.y_v = dataset[:, 1], dataset[:, 2]
+        self.game = game  # when given, every sample is seen through a random symmetry of the game
 
     def __len__(self):
         return len(self.X)
 
     def __getitem__(self, idx):
-        return np.int64(self.X[idx].transpose(2, 0, 1)), self.y_p[idx], self.y_v[idx]
+        state, policy = self.X[idx], self.y_p[idx]
+        if self.game is not None:
+            k = np.random.randint(len(self.game.symmetries()))
+            state, policy = self.game.transform_encoded(state, k), self.game.transform_policy(policy, k)
+        return np.int64(state.transpose(2, 0, 1)), policy, self.y_v[idx]
+
+
+class ReplayDataset(Dataset):
+
+    def __init__(self, buffer, game: Game = None):  # buffer = utils.replay.ReplayBuffer
+        self.buffer = buffer
+        self.game = game  # when given, every sample is seen through a random symmetry of the game
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, idx):
+        states, policies, values = self.buffer.gather([idx])
+        state, policy = states[0], policies[0].astype(np.float32)
+        if self.game is not None:
+            k = np.random.randint(len(self.game.symmetries()))
+            state = self.game.transform_encoded(state.transpose(1, 2, 0), k).transpose(2, 0, 1)
+            policy = self.game.transform_policy(policy, k)
+        return np.int64(state), policy, np.int64(values[0])
+
+
+class ReplayStream(IterableDataset):
+    """ Shuffled batches streamed from the shards of a ReplayBuffer.
+
+    The shards are cut into blocks of block_size consecutive positions,
+    shuffled every epoch (see set_epoch) and dealt round-robin to the
+    DataLoader workers. A worker reads shuffle_blocks blocks at a time
+    with contiguous slices of the memory-mapped shards, shuffles their
+    positions and yields whole batches of (states B x C x H x W, policies
+    B x action_size, values B) float tensors, so the DataLoader must be
+    built with batch_size=None. Blocks, shuffles and symmetries only
+    depend on seed, epoch and the worker id, and memory stays at a few
+    blocks whatever the size of the buffer.
+    """
+
+    def __init__(self, buffer, batch_size, game: Game = None, block_size=4096, shuffle_blocks=4, seed=0,
+                 num_workers=0):
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.game = game  # when given, every sample is seen through a random symmetry of the game
+        self.shuffle_blocks = shuffle_blocks
+        self.seed = seed
+        self.num_workers = num_workers  # of the DataLoader, for __len__
+        self.epoch = 0
+        self.blocks = [(k, start, min(start + block_size, len(shard)))
+                       for k, shard in enumerate(buffer.shards) for start in range(0, len(shard), block_size)]
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def worker_blocks(self, worker_id, num_workers):
+        order = np.random.RandomState([self.seed, self.epoch]).permutation(len(self.blocks))
+        return [self.blocks[i] for i in order[worker_id::num_workers]]
+
+    def __len__(self):  # batches per epoch, over all workers
+        num_workers = max(self.num_workers, 1)
+        return sum(-(-sum(stop - start for k, start, stop in self.worker_blocks(worker, num_workers))
+                     // self.batch_size) for worker in range(num_workers))
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, num_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        rng = np.random.RandomState([self.seed, self.epoch, worker_id])
+        blocks = self.worker_blocks(worker_id, num_workers)
+        rest = None
+        for first in range(0, len(blocks), self.shuffle_blocks):
+            chunk = blocks[first:first + self.shuffle_blocks]
+            shards = [self.buffer.shards[k] for k, start, stop in chunk]
+            columns = [np.concatenate([getattr(shard, name)[start:stop] for shard, (k, start, stop) in zip(shards, chunk)])
+                       for name in ["states", "policies", "values"]]
+            if rest is not None:  # positions left over from the previous chunk
+                columns = [np.concatenate([left, column]) for left, column in zip(rest, columns)]
+            order = rng.permutation(len(columns[2]))
+            last = first + self.shuffle_blocks >= len(blocks)
+            stop = len(order) if last else len(order) - len(order) % self.batch_size
+            for start in range(0, stop, self.batch_size):
+                yield self.collate(*[column[order[start:start + self.batch_size]] for column in columns], rng)
+            rest = [column[order[stop:]] for column in columns]
+
+    def collate(self, states, policies, values, rng):
+        states, policies = states.astype(np.float32), policies.astype(np.float32)
+        if self.game is not None:
+            symmetries = self.game.symmetries()
+            ks = rng.randint(len(symmetries), size=len(values))
+            for k in range(1, len(symmetries)):
+                selected = ks == k
+                states[selected] = self.game.transform_batch(states[selected], k)
+                policies[np.ix_(selected, symmetries[k])] = policies[selected]
+        return torch.from_numpy(states), torch.from_numpy(policies), torch.from_numpy(values.astype(np.float32))
@@ -0,0 +1,176 @@
+import copy
+import logging
+import os
+import pickle
+import warnings
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.ao.quantization as quantization
+from .inference import FusedAlphaNet
+from ..utils.replay import ReplayShard, SHARD_SUFFIX, iteration_dirs
+
+
+class QuantizableAlphaNet(nn.Module):
+    """ AlphaNet laid out for eager-mode static quantization.
+
+    Built from FusedAlphaNet (BatchNorm already folded): every convolution
+    or linear layer followed by a ReLU is fused with it, residual sums go
+    through FloatFunctional and the heads are dequantized before tanh and
+    softmax, which stay in float.
+    """
+
+    def __init__(self, net):
+        super().__init__()
+        fused = FusedAlphaNet(net)
+        self.game_state_shape = fused.game_state_shape
+        self.quant = quantization.QuantStub()
+        self.dequant = quantization.DeQuantStub()
+        self.conv = nn.Sequential(fused.conv, nn.ReLU())
+        self.res_blocks = nn.ModuleList()
+        for conv1, conv2 in fused.res_convs:
+            block = nn.Module()
+            block.conv1 = nn.Sequential(conv1, nn.ReLU())
+            block.conv2 = conv2
+            block.add = nn.quantized.FloatFunctional()
+            self.res_blocks.append(block)
+        self.value_conv = nn.Sequential(fused.value_conv, nn.ReLU())
+        self.value_fc1 = nn.Sequential(fused.value_fc1, nn.ReLU())
+        self.value_fc2 = fused.value_fc2
+        self.policy_conv = nn.Sequential(fused.policy_conv, nn.ReLU())
+        self.policy_fc = fused.policy_fc
+
+        groups = [["conv.0", "conv.1"], ["value_conv.0", "value_conv.1"], ["value_fc1.0", "value_fc1.1"],
+                  ["policy_conv.0", "policy_conv.1"]]
+        groups += [["res_blocks.%d.conv1.0" % i, "res_blocks.%d.conv1.1" % i] for i in range(len(self.res_blocks))]
+        quantization.fuse_modules(self.eval(), groups, inplace=True)
+
+    def forward(self, s):
+        s = self.conv(self.quant(s.reshape(self.game_state_shape)))
+        for block in self.res_blocks:
+            s = block.add.add_relu(block.conv2(block.conv1(s)), s)
+
+        v = self.value_fc1(self.value_conv(s).flatten(1))
+        v = torch.tanh(self.dequant(self.value_fc2(v)))
+        p = self.policy_conv(s).flatten(1)
+        p = torch.softmax(self.dequant(self.policy_fc(p)), dim=1)
+        return p, v
+
+
+QUANTIZED_ENGINES = ["x86", "fbgemm", "qnnpack"]  # by preference: x86 and fbgemm on Intel/AMD, qnnpack on ARM
+
+
+def quantized_engine():
+    """ The first of QUANTIZED_ENGINES supported by this torch build """
+    for engine in QUANTIZED_ENGINES:
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    raise RuntimeError("No int8 quantization engine in %s" % torch.backends.quantized.supported_engines)
+
+
+def quantize_net(net, calibration, backend=None, batch_size=64):
+    """ Post-training static int8 quantization of a copy of net, calibrated on the encoded states calibration """
+    backend = backend or quantized_engine()
+    torch.backends.quantized.engine = backend
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # eager-mode quantization deprecation notices
+        model = QuantizableAlphaNet(copy.deepcopy(net).cpu())
+        model.qconfig = quantization.get_default_qconfig(backend)
+        quantization.prepare(model, inplace=True)
+        with torch.no_grad():
+            for start in range(0, len(calibration), batch_size):
+                model(calibration[start:start + batch_size])
+        quantization.convert(model, inplace=True)
+    return model
+
+
+def quantization_drift(net, qnet, states):
+    """ Mean policy KL(fp32 || int8) and value MSE of qnet against net on states """
+    with torch.no_grad():
+        p, v = net(states)
+        q_p, q_v = qnet(states)
+    kl = (p * (torch.log(p + 1e-8) - torch.log(q_p + 1e-8))).sum(1).mean().item()
+    mse = ((v - q_v) ** 2).mean().item()
+    return {"policy_kl": kl, "value_mse": mse}
+
+
+def calibration_states(game_class, iteration=None, num_positions=512, num_iterations=2, data_dir="./datasets/",
+                       seed=0):
+    """ Encoded positions (N x C x H x W float tensor) for calibration.
+
+    Sampled from the self-play games of the num_iterations most recent
+    datasets/iter_* directories up to iteration, or from random games
+    when there is no self-play data yet.
+    """
+    rng = np.random.RandomState(seed)
+    dirs = iteration_dirs(data_dir, iteration, num_iterations)
+    states = []
+    for it, path in dirs:
+        for file in sorted(os.listdir(path)):
+            if file.endswith(SHARD_SUFFIX):  # channel-first already, see utils.replay
+                states.extend(ReplayShard(os.path.join(path, file)).states.transpose(0, 2, 3, 1))
+            elif not file.endswith(".tmp"):
+                with open(os.path.join(path, file), "rb") as f:
+                    states.extend(sample[0] for sample in pickle.load(f))
+    if states:
+        idx = rng.choice(len(states), min(num_positions, len(states)), replace=False)
+        logging.info("Calibrating on %d positions of iterations %s" % (len(idx), [it for it, path in dirs]))
+        return torch.from_numpy(np.ascontiguousarray(np.stack([states[i].transpose(2, 0, 1) for i in idx]),
+                                                     dtype=np.float32))
+
+    logging.info("No self-play data: calibrating on %d positions of random games" % num_positions)
+    game = game_class()
+    calibration = torch.empty([num_positions] + list(game.game_state_shape[1:]))
+    for i in range(num_positions):
+        if game.check_winner() is True or game.actions() == []:
+            game = game_class()
+        game.encode_into(calibration[i].numpy())
+        game.move(rng.choice(game.actions()))
+    return calibration
+
+
+class QuantizedNet():
+    """ int8 copy of an fp32 AlphaNet, quantized in the process that uses it.
+
+    Quantized modules cannot be pickled, so the object carries the fp32 net
+    and the calibration states and quantizes on its first call: it can be
+    sent to spawned self-play, arena or inference server processes like the
+    net itself. The accuracy drift against the fp32 net on the calibration
+    states is logged once quantized.
+    """
+
+    def __init__(self, net, calibration):
+        self.net = net
+        self.calibration = calibration
+        self.model = None
+        self.drift = None
+
+    def __getstate__(self):
+        return {"net": self.net, "calibration": self.calibration}
+
+    def __setstate__(self, state):
+        self.__init__(state["net"], state["calibration"])
+
+    def quantize(self):
+        self.net.eval()
+        self.model = quantize_net(self.net, self.calibration)
+        self.drift = quantization_drift(self.net, self.model, self.calibration)
+        logging.info("int8 net drift: policy KL %.2e, value MSE %.2e" % (
+            self.drift["policy_kl"], self.drift["value_mse"]))
+
+    def __call__(self, s):
+        if self.model is None:
+            self.quantize()
+        with torch.inference_mode():
+            return self.model(s.cpu())
+
+    # the parts of the nn.Module interface used by self-play and the inference server
+    def eval(self):
+        return self
+
+    def parameters(self):
+        return self.net.parameters()
+
+    def share_memory(self):
+        self.net.share_memory()
+        return self
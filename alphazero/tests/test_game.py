@@ -0,0 +1,176 @@
+import unittest
+
+
+class TestGame(unittest.TestCase):
+
+    def test_undo(self):
+
+        import copy
+        import numpy as np
+        from alphazero import Connect4
+
+        np.random.seed(0)
+        game = Connect4()
+        history = []
+        while game.check_winner() is not True and game.actions() != []:
+            history.append((copy.deepcopy(game.current_state), game.player, game.position_hash()))
+            move = np.random.choice(game.actions())
+            game.move(move)
+            self.assertEqual(game.position_hash(), game.compute_hash())
+            history[-1] = history[-1] + (move,)
+
+        for state, player, key, move in reversed(history):
+            game.undo(move)
+            np.testing.assert_array_equal(game.current_state, state)
+            self.assertEqual(game.player, player)
+            self.assertEqual(game.position_hash(), key)
+
+    def test_bitboard(self):
+
+        import numpy as np
+        from alphazero import Connect4, BitboardConnect4
+
+        np.random.seed(0)
+        for i in range(200):
+            game = Connect4()
+            bitboard = BitboardConnect4()
+            history = []
+            while True:
+                np.testing.assert_array_equal(bitboard.current_state, game.current_state)
+                np.testing.assert_array_equal(bitboard.encode_state(), game.encode_state())
+                self.assertEqual(bitboard.player, game.player)
+                self.assertEqual(bitboard.position_hash(), game.position_hash())
+                self.assertEqual(bitboard.position_hash(), bitboard.compute_hash())
+                self.assertEqual(bitboard.check_winner(), game.check_winner())
+                self.assertEqual(bitboard.actions(), game.actions())
+                if game.check_winner() is True or game.actions() == []:
+                    break
+                move = np.random.choice(game.actions())
+                game.move(move)
+                bitboard.move(move)
+                history.append(move)
+
+            decoded = bitboard.decode_state(bitboard.encode_state())
+            self.assertEqual(decoded.position_hash(), bitboard.position_hash())
+            self.assertEqual(decoded.actions(), bitboard.actions())
+            for move in reversed(history):
+                bitboard.undo(move)
+            self.assertEqual(bitboard.bitboards, [0, 0])
+            self.assertEqual(bitboard.position_hash(), 0)
+            self.assertEqual(bitboard.player, 0)
+
+        # full columns
+        bitboard = BitboardConnect4()
+        for i in range(6):
+            bitboard.move(3)
+        self.assertEqual(bitboard.move(3), "Invalid move")
+        self.assertEqual(bitboard.actions(), [0, 1, 2, 4, 5, 6])
+
+    def test_vec_connect4(self):
+
+        import numpy as np
+        from alphazero import Connect4, VecConnect4
+
+        np.random.seed(0)
+        num_games = 16
+        env = VecConnect4(num_games)
+        games = [Connect4() for i in range(num_games)]
+        finished = 0
+        while finished < 100:
+            encoded = env.encode().numpy()
+            legal = env.legal_mask()
+            for i, game in enumerate(games):
+                np.testing.assert_array_equal(encoded[i], game.encode_state().transpose(2, 0, 1))
+                np.testing.assert_array_equal(np.flatnonzero(legal[i]), game.actions())
+                self.assertEqual(env.game(i).position_hash(), game.position_hash())
+            actions = np.array([np.random.choice(game.actions()) for game in games])
+            actions[0] = -1  # board 0 sits this step out
+            terminal, winner = env.step(actions)
+            for i, game in enumerate(games):
+                if actions[i] < 0:
+                    self.assertFalse(terminal[i])
+                    continue
+                game.move(actions[i])
+                won = game.check_winner() is True
+                self.assertEqual(terminal[i], won or game.actions() == [])
+                self.assertEqual(winner[i], 1 - game.player if won else -1)
+                if terminal[i]:  # auto reset
+                    games[i] = Connect4()
+                    finished += 1
+
+        env = VecConnect4(2, auto_reset=False)
+        for i in range(3):
+            env.step([0, 1])
+            env.step([6, 5])
+        env.step([0, -1])
+        self.assertEqual(list(env.terminal()), [True, False])
+        self.assertEqual(list(env.winner()), [0, -1])
+        self.assertFalse(env.legal_mask()[0].any())
+        with self.assertRaises(ValueError):
+            env.step([0, -1])
+
+    def test_encode_into(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4, BitboardConnect4
+        from alphazero.game import encode_many
+
+        np.random.seed(0)
+        for game_class in [Connect4, BitboardConnect4]:
+            games = []
+            game = game_class()
+            out = np.empty([3, 6, 7], dtype=np.float32)
+            history = []
+            while game.check_winner() is not True and game.actions() != []:
+                game.encode_into(out)
+                np.testing.assert_array_equal(out, game.encode_state().transpose(2, 0, 1))
+                games.append(game.decode_state(game.encode_state()))
+                history.append(np.random.choice(game.actions()))
+                game.move(history[-1])
+            for move in reversed(history):
+                game.undo(move)
+                game.encode_into(out)
+                np.testing.assert_array_equal(out, game.encode_state().transpose(2, 0, 1))
+
+            batch = torch.zeros([len(games) + 1, 3, 6, 7])
+            self.assertIs(encode_many(games, batch), batch)
+            expected = np.stack([g.encode_state().transpose(2, 0, 1) for g in games])
+            np.testing.assert_array_equal(batch[:len(games)].numpy(), expected)
+            np.testing.assert_array_equal(encode_many(games), expected)
+
+    def test_symmetries(self):
+
+        import numpy as np
+        from alphazero import Connect4, BitboardConnect4
+        from alphazero.net.net import AlphaDataset
+
+        np.random.seed(0)
+        for game_class in [Connect4, BitboardConnect4]:
+            game, mirrored = game_class(), game_class()
+            dataset = []
+            while game.check_winner() is not True and game.actions() != []:
+                self.assertEqual(game.symmetric_hashes(), [mirrored.position_hash(), game.position_hash()][::-1])
+                self.assertEqual(game.mirror_key, game.compute_hash(mirror=True))
+                self.assertEqual(game.canonical_hash()[0], mirrored.canonical_hash()[0])
+                np.testing.assert_array_equal(game.transform_encoded(game.encode_state(), 1), mirrored.encode_state())
+                policy = np.random.dirichlet(np.ones(7))
+                dataset.append([game.encode_state(), policy, 0.5])
+                move = np.random.choice(game.actions())
+                game.move(move)
+                mirrored.move(game.symmetries()[1][move])
+
+            dataset = np.array(dataset, dtype=object)
+            augmented = AlphaDataset(dataset, game_class())
+            seen = set()
+            for i in range(50):
+                idx = i % len(dataset)
+                state, policy, value = augmented[idx]
+                if np.array_equal(policy, dataset[idx, 1]):
+                    np.testing.assert_array_equal(state, dataset[idx, 0].transpose(2, 0, 1))
+                    seen.add(0)
+                else:
+                    np.testing.assert_array_equal(policy, dataset[idx, 1][::-1])
+                    np.testing.assert_array_equal(state, dataset[idx, 0][:, ::-1].transpose(2, 0, 1))
+                    seen.add(1)
+            self.assertEqual(seen, {0, 1})
@@ -0,0 +1,379 @@
+import unittest
+
+
+class TestMCTS(unittest.TestCase):
+
+    def test_mcts(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+        from alphazero.mcts.play import get_policy
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 50, net, 1, 7)
+
+        # every read visits the root, the first one only expands it
+        self.assertEqual(root.number_visits[root.root], 50)
+        self.assertEqual(root.child_number_visits.shape, (7,))
+        self.assertEqual(root.child_number_visits.sum(), 49)
+        self.assertAlmostEqual(get_policy(root, 1).sum(), 1, places=5)
+
+        # expanded nodes hold one visit more than their children
+        for node in range(root.size):
+            if root.is_expanded(node):
+                start, stop = root.children(node)
+                self.assertEqual(root.number_visits[node], 1 + root.number_visits[start:stop].sum())
+        self.assertTrue((game.current_state == " ").all())
+
+    def test_batched_mcts(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 50, net, 1, 7, batch_size=8, virtual_loss=1.0)
+
+        # virtual loss is fully reverted once the batch is backed up
+        self.assertEqual(root.number_visits[root.root], 50)
+        for node in range(root.size):
+            if root.is_expanded(node):
+                start, stop = root.children(node)
+                self.assertGreaterEqual(root.number_visits[node], root.number_visits[start:stop].sum())
+        self.assertGreater(np.count_nonzero(root.child_number_visits), 1)
+
+    def test_subtree_reuse(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 100, net, 1, 7)
+            move = int(np.argmax(root.child_number_visits))
+            child = root.find_child(root.root, move)
+            kept_visits = root.number_visits[child]
+            grandchildren_visits = root.child_visits(child)
+            game.move(move)
+            root.promote(move)
+
+            self.assertEqual(root.number_visits[root.root], kept_visits)
+            np.testing.assert_array_equal(root.child_number_visits, grandchildren_visits)
+            np.testing.assert_array_equal(root.game.current_state, game.current_state)
+            for node in range(1, root.size):
+                self.assertIn(node, range(*root.children(root.parent[node])))
+
+            root = mcts(game, 100, net, 1, 7, tree=root)
+        self.assertEqual(root.number_visits[root.root], 100)
+
+    def test_transpositions(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 300, net, 1, 7, batch_size=4, transpositions=True)
+
+        self.assertEqual(root.number_visits[root.root], 300)
+        self.assertLess(root.num_evaluations, 300)
+        # transposed nodes point at the same children block, mirrored ones get mirrored moves
+        expanded = np.flatnonzero(root.n_child[:root.size] > 0)
+        blocks, nodes = {}, {}
+        for node in expanded:
+            blocks.setdefault((root.key[node], root.symmetry[node]), set()).add(root.first_child[node])
+            nodes.setdefault((root.key[node], root.symmetry[node]), node)
+        self.assertTrue(all(len(b) == 1 for b in blocks.values()))
+        self.assertLess(len(set(root.first_child[expanded])), len(expanded))
+        mirrored = [(key, k) for key, k in blocks if k == 1 and (key, 0) in blocks]
+        self.assertGreater(len(mirrored), 0)
+        for key, k in mirrored:
+            start, stop = root.children(nodes[(key, 1)])
+            other_start, other_stop = root.children(nodes[(key, 0)])
+            self.assertEqual(sorted(6 - root.move[start:stop]), sorted(root.move[other_start:other_stop]))
+
+        move = int(np.argmax(root.child_number_visits))
+        root.promote(move)
+        for node in range(1, root.size):
+            self.assertIn(node, range(*root.children(root.parent[node])))
+
+    def test_tree_parallel_mcts(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 100, net, 1, 7, batch_size=4, num_threads=3)
+
+        self.assertEqual(root.number_visits[root.root], 100)
+        for node in range(root.size):
+            if root.is_expanded(node):
+                start, stop = root.children(node)
+                self.assertGreaterEqual(root.number_visits[node], root.number_visits[start:stop].sum())
+        self.assertTrue((root.game.current_state == " ").all())
+
+    def test_root_parallel_mcts(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.root_parallel import RootParallelMCTS
+
+        torch.manual_seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        search = RootParallelMCTS(net, 2)
+        try:
+            root = search(game, 40, net, 1, 7)
+            self.assertEqual(root.child_number_visits.sum(), 2 * (20 - 1))
+            move = int(np.argmax(root.child_number_visits))
+            game.move(move)
+            root.promote(move)
+            root = search(game, 40, net, 1, 7, tree=root)
+            self.assertEqual(root.child_number_visits.shape, (7,))
+        finally:
+            search.close()
+
+    def test_search_budget(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 200, net, 0.1, 7, early_stop=True)
+            visits = np.sort(root.child_number_visits)
+            self.assertLessEqual(root.num_simulations, 200)
+            if root.num_simulations < 200:
+                self.assertGreater(visits[-1] - visits[-2], 200 - root.num_simulations)
+
+            root = mcts(game, None, net, 1, 7, time_budget=0.2)
+            self.assertGreater(root.num_simulations, 0)
+            self.assertEqual(root.number_visits[root.root], root.num_simulations)
+
+            # the budget never runs out before a root move has a visit
+            root = mcts(game, None, net, 1, 7, time_budget=1e-6)
+            self.assertGreater(root.child_number_visits.sum(), 0)
+            for move in [2, 1, 4, 5, 3, 1, 4, 4, 0, 2, 0, 3, 0, 3, 1, 1, 2, 0, 4, 4, 3, 0, 4, 5, 1, 5, 0, 3, 3, 2, 5, 5,
+                         1, 5, 2, 2]:
+                game.move(move)
+            self.assertEqual(game.actions(), [6])  # forced move
+            root = mcts(game, 200, net, 1, 7, early_stop=True)
+            self.assertEqual(root.child_number_visits[6], root.child_number_visits.sum())
+            self.assertGreater(root.child_number_visits[6], 0)
+            self.assertLess(root.num_simulations, 200)
+
+    def test_search_finished_game(self):
+
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        net = AlphaNet(Connect4())
+        net.eval()
+        won, drawn = Connect4(), Connect4()
+        for move in [0, 1, 0, 1, 0, 1, 0]:
+            won.move(move)
+        for move in [3, 6, 1, 3, 1, 3, 6, 4, 5, 5, 3, 4, 3, 1, 1, 0, 4, 3, 0, 4, 6, 6, 2, 6, 1, 0, 5, 5, 2, 4, 5, 1,
+                     5, 6, 0, 0, 2, 2, 4, 2, 2, 0]:
+            drawn.move(move)
+        self.assertTrue(won.check_winner())
+        self.assertEqual(drawn.actions(), [])
+        with torch.no_grad():
+            for game in [won, drawn]:
+                for kwargs in [{"num_reads": 10}, {"num_reads": None, "time_budget": 0.05},
+                               {"num_reads": 10, "early_stop": True}]:
+                    num_reads = kwargs.pop("num_reads")
+                    root = mcts(game, num_reads, net, 1, 7, **kwargs)
+                    self.assertEqual(root.num_simulations, 0)
+
+    def test_mcts_solver(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        for move in [0, 1, 0, 1, 0, 1]:
+            game.move(move)
+        net = AlphaNet(game)
+        net.eval()
+        with torch.no_grad():
+            root = mcts(game, 200, net, 1, 7)
+
+        winning_child = root.find_child(root.root, 0)
+        self.assertEqual(root.proven_value[winning_child], 1)
+        self.assertEqual(root.proven_value[root.root], -1)
+        self.assertEqual(np.argmax(root.child_number_visits), 0)
+        self.assertLess(root.num_evaluations, 200)
+
+    def test_evaluation_cache(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+        from alphazero.mcts.cache import EvaluationCache
+        from alphazero.net.backends import TorchEvaluator
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        cache = EvaluationCache(max_size=1000)
+        with torch.no_grad():
+            root = mcts(game, 100, net, 1, 7, cache=cache)
+            evaluations = root.num_evaluations
+            self.assertEqual(len(cache.entries), evaluations)
+            root = mcts(game, 100, net, 1, 7, cache=cache)
+        self.assertGreater(cache.hit_rate(), 0)
+        self.assertLess(root.num_evaluations, evaluations)
+        self.assertGreater(cache.stats()["memory_bytes"], 0)
+
+        small_cache = EvaluationCache(max_size=10)
+        with torch.no_grad():
+            mcts(game, 100, net, 1, 7, cache=small_cache)
+        self.assertEqual(len(small_cache.entries), 10)
+
+        with torch.no_grad():
+            net.outblock.fc2.bias.add_(1.0)
+        cache.sync(net)
+        self.assertEqual(len(cache.entries), 0)
+
+        with torch.no_grad():  # an evaluator of the same net shares its entries
+            mcts(game, 20, TorchEvaluator(net), 1, 7, cache=cache)
+            self.assertGreater(len(cache.entries), 0)
+            cache.sync(net)
+            self.assertGreater(len(cache.entries), 0)
+            net.outblock.fc2.bias.add_(1.0)
+        cache.sync(TorchEvaluator(net))
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_mirrored_cache(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+        from alphazero.mcts.cache import EvaluationCache
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        cache = EvaluationCache()
+        left, right = Connect4(), Connect4()
+        left.move(1)
+        right.move(5)
+        self.assertEqual(left.canonical_hash()[0], right.canonical_hash()[0])
+        with torch.no_grad():
+            left_root = mcts(left, 50, net, 1, 7, cache=cache)
+            right_root = mcts(right, 1, net, 1, 7, cache=cache)
+        self.assertEqual(right_root.num_evaluations, 0)  # the mirror image of the left root was cached
+        self.assertNotEqual(left_root.symmetry[left_root.root], right_root.symmetry[right_root.root])
+
+        priors = np.arange(7, dtype=np.float32)
+        canonical = right_root.to_canonical(right_root.root, priors)
+        np.testing.assert_array_equal(right_root.from_canonical(right_root.root, canonical), priors)
+        np.testing.assert_array_equal(canonical, left_root.to_canonical(left_root.root, priors[::-1]))
+
+    def test_position_table(self):
+
+        import os
+        import pickle
+        import tempfile
+        import numpy as np
+        import torch
+        from alphazero import BitboardConnect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+        from alphazero.mcts.table import PositionTable, build_table, write_table, solve, quiet_moves
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        net = AlphaNet(BitboardConnect4())
+        net.eval()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "table.bin")
+            with torch.no_grad():
+                table = build_table(path, BitboardConnect4, net, book_depth=2, book_reads=20, endgame_empty_cells=8,
+                                    endgame_games=5)
+            table = pickle.loads(pickle.dumps(table))  # reopens the file
+            self.assertEqual(int((~table.solved).sum()), 1 + 4)  # empty board and 4 first moves up to mirroring
+
+            policy, value, solved = table.get(BitboardConnect4())
+            self.assertFalse(solved)
+            self.assertAlmostEqual(float(policy.sum()), 1, places=2)
+            left, right = BitboardConnect4(), BitboardConnect4()
+            left.move(1)
+            right.move(5)
+            np.testing.assert_array_equal(table.get(left)[0], table.get(right)[0][::-1])
+
+            # an endgame: solved leaves are proven without net calls
+            game = BitboardConnect4()
+            while game.game_dim - sum(bin(b).count("1") for b in game.bitboards) > 9:
+                game.move(np.random.choice(quiet_moves(game)))
+            entries = {}
+            expected = solve(game, entries)
+            write_table(path, entries, game.action_size)
+            table = PositionTable(path)
+            self.assertEqual(table.get(game)[1:], (expected, True))
+            with torch.no_grad():
+                root = mcts(game, 50, net, 1, 7, table=table)
+            self.assertEqual(root.num_evaluations, 1)  # the root only
+            self.assertEqual(-root.proven_value[root.root], expected)
@@ -0,0 +1,297 @@
+import importlib.util
+import unittest
+
+
+class TestNet(unittest.TestCase):
+
+    def test_export_for_inference(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.net.inference import latency_table
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        net = AlphaNet(Connect4())
+        net.train()
+        with torch.no_grad():  # non-trivial BatchNorm statistics
+            for i in range(3):
+                net(torch.rand(16, 3, 6, 7))
+        net.eval()
+
+        s = torch.rand(5, 3, 6, 7)
+        with torch.no_grad():
+            expected_p, expected_v = net(s)
+        for channels_last in [False, True]:
+            for trace in [False, True]:
+                exported = net.export_for_inference(channels_last=channels_last, trace=trace)
+                p, v = exported(s)
+                np.testing.assert_allclose(p.numpy(), expected_p.numpy(), atol=1e-5)
+                np.testing.assert_allclose(v.numpy(), expected_v.numpy(), atol=1e-5)
+        exported = net.export_for_inference()
+        p, v = exported(s[0])  # single unbatched state
+        np.testing.assert_allclose(p.numpy(), expected_p[:1].numpy(), atol=1e-5)
+
+        root = mcts(Connect4(), 20, exported, 1, 7, batch_size=4)
+        self.assertEqual(root.number_visits[root.root], 20)
+
+        report = latency_table(net, batch_sizes=(1, 4), repeats=2, exported=exported)
+        self.assertEqual([row[0] for row in report], [1, 4])
+        self.assertTrue(all(row[1] > 0 and row[2] > 0 for row in report))
+
+    def test_quantize(self):
+
+        import os
+        import pickle
+        import tempfile
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.net.quantization import QuantizedNet, calibration_states, quantized_engine
+        from alphazero.mcts.search import mcts
+
+        torch.manual_seed(0)
+        net = AlphaNet(Connect4()).eval()
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            for iteration in range(3):
+                os.mkdir(os.path.join(data_dir, "iter_%d" % iteration))
+                game = Connect4()
+                dataset = []
+                for move in [3, 3, 2, iteration]:
+                    dataset.append([game.encode_state(), np.ones(7) / 7, 0])
+                    game.move(move)
+                with open(os.path.join(data_dir, "iter_%d" % iteration, "dataset"), "wb") as f:
+                    pickle.dump(dataset, f)
+            calibration = calibration_states(Connect4, iteration=1, num_positions=100, data_dir=data_dir)
+        self.assertEqual(list(calibration.shape), [8, 3, 6, 7])  # iterations 0 and 1 only
+        np.testing.assert_array_equal(calibration[:, 0].sum((1, 2)) + calibration[:, 1].sum((1, 2)) <= 3, True)
+
+        random_calibration = calibration_states(Connect4, num_positions=64, data_dir=data_dir)  # random games
+        self.assertEqual(list(random_calibration.shape), [64, 3, 6, 7])
+
+        qnet = pickle.loads(pickle.dumps(QuantizedNet(net, calibration)))  # as sent to worker processes
+        s = torch.rand(5, 3, 6, 7).round()
+        p, v = qnet(s)
+        expected_p, expected_v = net(s)
+        self.assertLess(qnet.drift["policy_kl"], 1e-3)
+        self.assertLess(qnet.drift["value_mse"], 1e-3)
+        np.testing.assert_allclose(p.detach().numpy(), expected_p.detach().numpy(), atol=0.05)
+        np.testing.assert_allclose(p.sum(1).numpy(), 1, atol=1e-5)
+        self.assertEqual(list(v.shape), [5, 1])
+
+        root = mcts(Connect4(), 20, qnet, 1, 7, batch_size=4)
+        self.assertEqual(root.number_visits[root.root], 20)
+        self.assertIn(quantized_engine(), torch.backends.quantized.supported_engines)
+        self.assertEqual(torch.backends.quantized.engine, quantized_engine())
+
+    def test_profiles(self):
+
+        import os
+        import tempfile
+        from argparse import Namespace
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.net.learning import distill, self_play_student
+        from alphazero.net.evaluating import match, profile_report
+        from alphazero.net.quantization import calibration_states
+
+        torch.manual_seed(0)
+        teacher = AlphaNet(Connect4())
+        self.assertEqual(teacher.profile(), {"n_channels": 128, "n_res_blocks": 10})
+        student = AlphaNet(Connect4(), profile="tiny")
+        self.assertEqual(student.profile(), {"n_channels": 32, "n_res_blocks": 2})
+        self.assertEqual(AlphaNet(Connect4(), profile={"n_res_blocks": 1}).profile(),
+                         {"n_channels": 128, "n_res_blocks": 1})
+        self.assertEqual(len(list(teacher.children())), 1 + 10 + 1)  # a single input ConvBlock
+        with self.assertRaises(ValueError):
+            AlphaNet(Connect4(), profile="huge")
+
+        states = calibration_states(Connect4, num_positions=128, data_dir="/nonexistent")
+        before = distill(teacher, AlphaNet(Connect4(), profile="tiny"), states, num_epochs=0)
+        after = distill(teacher, student, states, num_epochs=5, batch_size=32)
+        self.assertLess(after["policy_kl"], before["policy_kl"])
+        self.assertLess(after["value_mse"], before["value_mse"])
+
+        score = match(student, teacher, Connect4, num_games=2, num_reads=8)
+        self.assertTrue(0 <= score <= 1)
+        report = profile_report(teacher, {"tiny": student}, Connect4, num_games=1, num_reads=4, states=states)
+        self.assertEqual([row[0] for row in report], ["teacher", "tiny"])
+        self.assertGreater(report[0][1], report[1][1])
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as root:
+            os.chdir(root)
+            try:
+                os.mkdir("model_data")
+                torch.save({'state_dict': teacher.state_dict()}, "model_data/net_iter0.pth.tar")
+                args = Namespace(neural_net_name="net", self_play_profile="tiny", distill_positions=64,
+                                 distill_epochs=1, batch_size=32, lr=0.001)
+                distilled = self_play_student(args, AlphaNet, Connect4, 0)
+                self.assertTrue(os.path.isfile("model_data/net_tiny_iter0.pth.tar"))
+                loaded = self_play_student(args, AlphaNet, Connect4, 0)
+                for name, value in distilled.state_dict().items():
+                    self.assertTrue(torch.equal(value, loaded.state_dict()[name]))
+            finally:
+                os.chdir(cwd)
+
+    @unittest.skipIf(importlib.util.find_spec("onnxruntime") is None, "onnxruntime is not installed")
+    def test_onnx_evaluator(self):
+
+        import os
+        import pickle
+        import tempfile
+        import time
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.net.backends import make_evaluator
+        from alphazero.mcts.search import mcts, evaluate_leaves
+
+        torch.manual_seed(0)
+        net = AlphaNet(Connect4())
+        evaluator = make_evaluator(net, "torch")
+        self.assertFalse(net.training)
+        s = torch.rand(5, 3, 6, 7)
+        with torch.no_grad():
+            expected_p, expected_v = net(s)
+        p, v = evaluator(s)
+        np.testing.assert_allclose(p.numpy(), expected_p.numpy(), atol=1e-6)
+        for backend in [net, evaluator, net.export_for_inference()]:  # nets are run by the torch backend
+            p, v = evaluate_leaves(backend, s)
+            np.testing.assert_allclose(p, expected_p.numpy(), atol=1e-5)
+            np.testing.assert_allclose(v, expected_v.numpy().reshape(-1), atol=1e-5)
+
+        with tempfile.TemporaryDirectory() as root:
+            checkpoint_path = os.path.join(root, "net_iter0.pth.tar")
+            torch.save({'state_dict': net.state_dict()}, checkpoint_path)
+            evaluator = make_evaluator(net, "onnx", checkpoint_path)
+            self.assertEqual(evaluator.path, os.path.join(root, "net_iter0.onnx"))
+            evaluator = pickle.loads(pickle.dumps(evaluator))  # as sent to worker processes
+            for states in [s, s.numpy(), s[:1]]:
+                p, v = evaluator(states)
+                np.testing.assert_allclose(p.numpy(), expected_p[:len(states)].numpy(), atol=1e-5)
+                np.testing.assert_allclose(v.numpy(), expected_v[:len(states)].numpy(), atol=1e-5)
+
+            exported = os.path.getmtime(evaluator.path)
+            make_evaluator(net, "onnx", checkpoint_path)  # up to date: not exported again
+            self.assertEqual(os.path.getmtime(evaluator.path), exported)
+            time.sleep(0.01)
+            torch.save({'state_dict': net.state_dict()}, checkpoint_path)
+            make_evaluator(net, "onnx", checkpoint_path)
+            self.assertGreater(os.path.getmtime(evaluator.path), exported)
+
+            root = mcts(Connect4(), 20, evaluator, 1, 7, batch_size=4)
+            self.assertEqual(root.number_visits[root.root], 20)
+        with self.assertRaises(ValueError):
+            make_evaluator(net, "tensorrt")
+
+    def test_fast_train(self):
+
+        import os
+        import tempfile
+        from argparse import Namespace
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.net.net import AlphaLoss
+        from alphazero.net.learning import train, training_throughput
+
+        torch.manual_seed(0)
+        net = AlphaNet(Connect4(), profile="tiny").eval()
+        s = torch.rand(6, 3, 6, 7).round()
+        with torch.no_grad():
+            p, v = net(s)
+            log_p, log_v = net(s, log_policy=True)
+        np.testing.assert_allclose(log_p.exp().numpy(), p.numpy(), atol=1e-6)
+        target_p, target_v = torch.softmax(torch.rand(6, 7), 1), torch.rand(6) * 2 - 1
+        np.testing.assert_allclose(AlphaLoss()(v[:, 0], target_v, log_p, target_p, log_policy=True).item(),
+                                   AlphaLoss()(v[:, 0], target_v, p, target_p).item(), rtol=1e-5)
+
+        args = Namespace(batch_size=8, lr=0.001, max_norm=1.0, gradient_acc_steps=1, num_epochs=2,
+                         neural_net_name="net", fast_train=True, train_compile=False)
+        self.assertGreater(training_throughput(net, args, num_batches=2, warmup=1), 0)
+
+        game = Connect4()
+        dataset = []
+        for move in [3, 3, 2, 4, 2, 1, 0, 5]:
+            dataset.append([game.encode_state(), np.ones(7) / 7, 1])
+            game.move(move)
+        dataset = np.array(dataset, dtype=object)
+        optimizer = torch.optim.Adam(net.parameters(), lr=args.lr)
+        scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer, milestones=[50])
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as root:
+            os.chdir(root)
+            try:
+                os.mkdir("model_data")
+                before = [param.detach().clone() for param in net.parameters()]
+                train(net, dataset, optimizer, scheduler, 0, 0, args, 0)
+                self.assertTrue(os.path.isfile("model_data/net_iter1.pth.tar"))
+                self.assertTrue(any(not torch.equal(a, b) for a, b in zip(before, net.parameters())))
+            finally:
+                os.chdir(cwd)
+
+    def test_replay_stream(self):
+
+        import os
+        import tempfile
+        import numpy as np
+        import torch
+        from torch.utils.data import DataLoader
+        from alphazero import Connect4
+        from alphazero.net.net import ReplayStream
+        from alphazero.utils.replay import ReplayBuffer, write_shard
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.mkdir(os.path.join(data_dir, "iter_0"))
+            n = 0
+            for shard, size in enumerate([300, 45, 200]):  # position i: states[:, 0, 0] = (i % 256, i // 256, 0)
+                ids = np.arange(n, n + size)
+                states = np.zeros([size, 3, 6, 7], dtype=np.uint8)
+                states[:, 0, 0, 0], states[:, 1, 0, 0] = ids % 256, ids // 256
+                policies = np.zeros([size, 7])
+                policies[:, 0] = 1  # the column of the marker
+                write_shard(os.path.join(data_dir, "iter_0", "shard_%d.azrb" % shard), states, policies, ids % 3 - 1)
+                n += size
+            buffer = ReplayBuffer(0, data_dir=data_dir)
+
+            def positions(batches):
+                return np.concatenate([(s[:, 0, 0, 0] + 256 * s[:, 1, 0, 0]).numpy() for s, p, v in batches])
+
+            stream = ReplayStream(buffer, 32, block_size=64, shuffle_blocks=2, seed=1)
+            batches = list(stream)
+            self.assertEqual(len(batches), len(stream))
+            self.assertTrue(all(len(v) == 32 for s, p, v in batches[:-1]))
+            s, p, v = batches[0]
+            self.assertEqual((s.dtype, p.dtype, v.dtype), (torch.float32, torch.float32, torch.float32))
+            self.assertEqual(list(s.shape), [32, 3, 6, 7])
+            ids = positions(batches)
+            np.testing.assert_array_equal(np.sort(ids), np.arange(n))
+            np.testing.assert_array_equal(np.concatenate([v.numpy() for s, p, v in batches]), ids % 3 - 1)
+            np.testing.assert_array_equal(positions(stream), ids)  # deterministic
+            stream.set_epoch(1)
+            self.assertFalse(np.array_equal(positions(stream), ids))
+
+            stream = ReplayStream(buffer, 32, block_size=64, seed=1, num_workers=2)
+            loader = DataLoader(stream, batch_size=None, num_workers=2)
+            batches = list(loader)
+            self.assertEqual(len(batches), len(loader))
+            ids = positions(batches)
+            np.testing.assert_array_equal(np.sort(ids), np.arange(n))
+            np.testing.assert_array_equal(positions(loader), ids)
+
+            stream = ReplayStream(buffer, 64, Connect4(), block_size=64)
+            flipped = 0
+            for s, p, v in stream:
+                # the marker and the policy are mirrored together (position 0 has no marker)
+                marked = s[:, :2, 0].sum((1, 2)) > 0
+                np.testing.assert_array_equal(p.argmax(1)[marked], s[marked, :2, 0].sum(1).argmax(1))
+                flipped += int((p.argmax(1) == 6).sum())
+            self.assertTrue(0 < flipped < n)
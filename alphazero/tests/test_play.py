@@ -0,0 +1,199 @@
+import unittest
+
+
+class TestPlay(unittest.TestCase):
+
+    def test_vectorized_self_play(self):
+
+        import os
+        import pickle
+        import tempfile
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.play import vectorized_self_play
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        net = AlphaNet(Connect4())
+        net.eval()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with torch.no_grad():
+                    vectorized_self_play(net, Connect4, 3, 0, 0, 1.1, 0, num_parallel_games=2, num_reads=10,
+                                         batch_size=2)
+                files = sorted(os.listdir("datasets/iter_0"))
+                self.assertEqual(len(files), 3)
+                with open(os.path.join("datasets/iter_0", files[0]), "rb") as f:
+                    dataset = pickle.load(f)
+
+                with torch.no_grad(), self.assertNoLogs(level="WARNING"):  # num_threads at its default
+                    vectorized_self_play(net, Connect4, 2, 0, 0, 1.1, 1, num_parallel_games=2, num_reads=None,
+                                         time_budget=0.001, num_threads=1)
+                self.assertEqual(len(os.listdir("datasets/iter_1")), 2)
+                with self.assertLogs(level="WARNING"), torch.no_grad():
+                    vectorized_self_play(net, Connect4, 1, 0, 0, 1.1, 2, num_reads=5, num_threads=2)
+            finally:
+                os.chdir(cwd)
+
+        s, p, v = dataset[-1]
+        self.assertEqual(s.shape, (6, 7, 3))
+        self.assertEqual(p.shape, (7,))
+        self.assertAlmostEqual(p.sum(), 1, places=5)
+        self.assertIn(v, [-1, 0, 1])
+
+    def test_replay_buffer(self):
+
+        import os
+        import pickle
+        import tempfile
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.net.net import ReplayDataset
+        from alphazero.mcts.play import vectorized_self_play
+        from alphazero.utils.replay import ReplayBuffer, migrate_pickles
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        net = AlphaNet(Connect4(), profile="tiny")
+        net.eval()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with torch.no_grad():
+                    vectorized_self_play(net, Connect4, 3, 0, 0, 1.1, 0, num_parallel_games=2, num_reads=5,
+                                         replay_shard_size=20)
+                    vectorized_self_play(net, Connect4, 2, 0, 0, 1.1, 1, num_parallel_games=2, num_reads=5)
+                shards = sorted(os.listdir("datasets/iter_0"))
+                self.assertTrue(all(file.endswith(".azrb") for file in shards))
+                pickles = sorted(os.listdir("datasets/iter_1"))
+                games = []
+                for file in pickles:
+                    with open(os.path.join("datasets/iter_1", file), "rb") as f:
+                        games.extend(pickle.load(f))
+
+                self.assertEqual(len(ReplayBuffer(1, window=2)), len(ReplayBuffer(0)))  # iter_1 not migrated
+                paths = migrate_pickles("datasets/iter_1", remove=True)
+                self.assertEqual(os.listdir("datasets/iter_1"), [os.path.basename(path) for path in paths])
+                buffer = ReplayBuffer(1, window=1)
+                self.assertEqual(len(buffer), len(games))
+                states, policies, values = buffer.gather(np.arange(len(games)))
+                np.testing.assert_array_equal(states, np.stack([s.transpose(2, 0, 1) for s, p, v in games]))
+                np.testing.assert_allclose(policies, np.stack([p for s, p, v in games]), atol=1e-3)
+                np.testing.assert_array_equal(values, [v for s, p, v in games])
+                self.assertEqual(states.dtype, np.uint8)
+                self.assertEqual(policies.dtype, np.float16)
+                self.assertEqual(values.dtype, np.int8)
+
+                buffer = ReplayBuffer(1, window=2)
+                self.assertEqual(buffer.iterations, [0, 1])
+                self.assertEqual(len(buffer), len(ReplayBuffer(0)) + len(games))
+                order = np.random.permutation(len(buffer))
+                states, policies, values = buffer.gather(order)
+                for i in order[:5]:
+                    s, p, v = ReplayDataset(buffer)[i]
+                    np.testing.assert_array_equal(s, states[list(order).index(i)])
+                    self.assertEqual(s.shape, (3, 6, 7))
+                    self.assertEqual(p.dtype, np.float32)
+                    self.assertIn(v, [-1, 0, 1])
+                self.assertEqual(ReplayDataset(buffer, Connect4())[0][0].shape, (3, 6, 7))
+
+                with open("datasets/iter_1/late_games", "wb") as f:  # pickled after the first migration
+                    pickle.dump(games, f)
+                new_paths = migrate_pickles("datasets/iter_1", remove=True)
+                self.assertEqual(len(set(paths) & set(new_paths)), 0)
+                self.assertEqual(sorted(os.listdir("datasets/iter_1")),
+                                 sorted(os.path.basename(path) for path in paths + new_paths))
+                self.assertEqual(len(ReplayBuffer(1, window=1)), 2 * len(games))
+            finally:
+                os.chdir(cwd)
+
+    def test_inference_server(self):
+
+        import numpy as np
+        import torch
+        from alphazero import Connect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.search import mcts
+        from alphazero.mcts.inference_server import InferenceServer
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        game = Connect4()
+        net = AlphaNet(game)
+        net.eval()
+        server = InferenceServer(net, 2, game.game_state_shape[1:], game.action_size, client_capacity=4)
+        try:
+            client = server.client(1)
+            encoded_s = torch.rand(6, 3, 6, 7)
+            with torch.no_grad():
+                child_priors, value_estimates = client(encoded_s)
+                expected_priors, expected_values = net(encoded_s)
+                np.testing.assert_allclose(child_priors.numpy(), expected_priors.numpy(), atol=1e-5)
+                np.testing.assert_allclose(value_estimates.numpy(), expected_values.numpy(), atol=1e-5)
+
+                root = mcts(game, 20, client, 1, 7, batch_size=4)
+            self.assertEqual(root.number_visits[root.root], 20)
+            stats = server.stats()
+            self.assertGreater(stats["batches"], 0)
+            self.assertGreater(stats["latency_ms"]["mean"], 0)
+        finally:
+            server.close()
+
+    def test_self_play_position_table(self):
+
+        import os
+        import pickle
+        import tempfile
+        import numpy as np
+        import torch
+        from alphazero import BitboardConnect4
+        from alphazero import AlphaNet
+        from alphazero.mcts.play import vectorized_self_play
+        from alphazero.mcts.table import build_table, table_policy, write_table
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        net = AlphaNet(BitboardConnect4())
+        net.eval()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with torch.no_grad():
+                    table = build_table("table.bin", BitboardConnect4, net, book_depth=2, book_reads=20,
+                                        endgame_empty_cells=0, endgame_games=0)
+                    vectorized_self_play(net, BitboardConnect4, 2, 0, 0, 1.1, 0, num_parallel_games=2, num_reads=10,
+                                         batch_size=2, position_table="table.bin")
+                files = sorted(os.listdir("datasets/iter_0"))
+                with open(os.path.join("datasets/iter_0", files[0]), "rb") as f:
+                    dataset = pickle.load(f)
+                book_policy = table_policy(table.get(BitboardConnect4())[0], 1.1)
+
+                # a book move leads to a solved position: the game is adjudicated without any search
+                entries = {BitboardConnect4().canonical_hash()[0]: (np.ones(7) / 7, 0, False)}
+                for move in range(7):
+                    game = BitboardConnect4()
+                    game.move(move)
+                    entries[game.canonical_hash()[0]] = (np.ones(7) / 7, 0, True)
+                write_table("solved.bin", entries, 7)
+                with torch.no_grad():
+                    vectorized_self_play(net, BitboardConnect4, 3, 0, 0, 1.1, 1, num_parallel_games=2, num_reads=10,
+                                         position_table="solved.bin")
+                solved_games = []
+                for file in sorted(os.listdir("datasets/iter_1")):
+                    with open(os.path.join("datasets/iter_1", file), "rb") as f:
+                        solved_games.append(pickle.load(f))
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual([len(game) for game in solved_games], [1, 1, 1])
+        self.assertEqual(len(files), 2)
+        s, p, v = dataset[0]  # the first move comes from the book
+        np.testing.assert_allclose(p, book_policy, rtol=1e-5)
@@ -0,0 +1,172 @@
+import logging
+import os
+import pickle
+import re
+import numpy as np
+
+MAGIC = b"AZRB"
+HEADER_BYTES = 64
+SHARD_SUFFIX = ".azrb"
+
+
+class ReplayShard():
+    """ Read-only columnar shard of self-play positions.
+
+    The file written by write_shard holds, for n positions: the encoded
+    states channel-first (uint8, n x C x H x W), the MCTS policies
+    (float16, n x action_size) and the game values (int8). The file is
+    memory-mapped and the columns are views of it. A pickled shard reopens
+    its file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(raw[:4]) != MAGIC:
+            raise ValueError("%s is not a replay shard." % path)
+        n, channels, height, width, action_size = raw[8:48].view(np.int64)
+        state_size = channels * height * width
+        offset = HEADER_BYTES
+        self.states = raw[offset:offset + n * state_size].reshape(n, channels, height, width)
+        offset += n * state_size
+        self.policies = raw[offset:offset + 2 * n * action_size].view(np.float16).reshape(n, action_size)
+        offset += 2 * n * action_size
+        self.values = raw[offset:offset + n].view(np.int8)
+        self.raw = raw
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+def write_shard(path, states, policies, values):
+    """ Writes positions as a ReplayShard file: states n x C x H x W, policies n x action_size, values n """
+    states = np.ascontiguousarray(states, dtype=np.uint8)
+    policies = np.ascontiguousarray(policies, dtype=np.float16)
+    values = np.ascontiguousarray(values, dtype=np.int8)
+    header = np.zeros([HEADER_BYTES], dtype=np.uint8)
+    header[:4] = np.frombuffer(MAGIC, dtype=np.uint8)
+    header[8:48] = np.array([len(values)] + list(states.shape[1:]) + [policies.shape[1]], dtype=np.int64).view(np.uint8)
+    with open(path + ".tmp", "wb") as f:  # renamed once complete: readers never see a partial shard
+        for array in [header, states, policies, values]:
+            f.write(array.tobytes())
+    os.replace(path + ".tmp", path)
+    return path
+
+
+class ShardWriter():
+    """ Buffers the positions of finished games and writes them as shards of about shard_size positions.
+
+    Shards are named <prefix>_<index of their first game><SHARD_SUFFIX> in
+    directory, so that writers with distinct prefixes (one per self-play
+    worker) never collide.
+    """
+
+    def __init__(self, directory, prefix, shard_size=4096):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.samples = []
+        self.first_game = None
+
+    def add_game(self, samples, game_idx):
+        """ samples: the (encoded state H x W x C, policy, value) of every position of the game.
+        Returns the path of the shard written, if any. """
+        if self.first_game is None:
+            self.first_game = game_idx
+        self.samples.extend(samples)
+        if len(self.samples) >= self.shard_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self.samples:
+            return None
+        path = os.path.join(self.directory, "%s_%d%s" % (self.prefix, self.first_game, SHARD_SUFFIX))
+        write_shard(path, np.stack([np.asarray(s).transpose(2, 0, 1) for s, p, v in self.samples]),
+                    np.stack([p for s, p, v in self.samples]), [v for s, p, v in self.samples])
+        logging.info("Wrote %d positions to %s" % (len(self.samples), path))
+        self.samples, self.first_game = [], None
+        return path
+
+
+def iteration_dirs(data_dir="./datasets/", iteration=None, window=None):
+    """ (iteration, path) of the datasets/iter_* directories, the window most recent up to iteration """
+    iterations = []
+    if os.path.isdir(data_dir):
+        for name in os.listdir(data_dir):
+            match = re.fullmatch(r"iter_(\d+)", name)
+            if match and (iteration is None or int(match.group(1)) <= iteration):
+                iterations.append(int(match.group(1)))
+    iterations = sorted(iterations)[-window:] if window else sorted(iterations)
+    return [(it, os.path.join(data_dir, "iter_%d" % it)) for it in iterations]
+
+
+class ReplayBuffer():
+    """ Positions of the shards of the last window self-play iterations up to iteration.
+
+    The shards stay memory-mapped: positions are read from disk when
+    gathered, so the buffer costs no memory beyond the page cache.
+    """
+
+    def __init__(self, iteration, window=1, data_dir="./datasets/"):
+        self.iterations = []
+        self.shards = []
+        for it, path in iteration_dirs(data_dir, iteration, window):
+            self.iterations.append(it)
+            files = sorted(os.listdir(path))
+            self.shards.extend(ReplayShard(os.path.join(path, file)) for file in files if file.endswith(SHARD_SUFFIX))
+            if any(not file.endswith(SHARD_SUFFIX) and not file.endswith(".tmp") for file in files):
+                logging.warning("%s holds pickled games, which the replay buffer ignores: see migrate_pickles" % path)
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, indices):
+        """ Returns the (states, policies, values) arrays of the positions at indices """
+        indices = np.asarray(indices, dtype=np.int64)
+        shard_idx = np.searchsorted(self.offsets, indices, side="right") - 1
+        first = self.shards[0]
+        states = np.empty((len(indices),) + first.states.shape[1:], dtype=np.uint8)
+        policies = np.empty((len(indices), first.policies.shape[1]), dtype=np.float16)
+        values = np.empty(len(indices), dtype=np.int8)
+        for k in np.unique(shard_idx):
+            selected = np.flatnonzero(shard_idx == k)
+            local = indices[selected] - self.offsets[k]
+            states[selected] = self.shards[k].states[local]
+            policies[selected] = self.shards[k].policies[local]
+            values[selected] = self.shards[k].values[local]
+        return states, policies, values
+
+    def report(self):
+        logging.info("Replay buffer: %d positions in %d shards of iterations %s (%.1f MB)" % (
+            len(self), len(self.shards), self.iterations, sum(len(shard.raw) for shard in self.shards) / 2 ** 20))
+
+
+def migrate_pickles(directory, shard_size=65536, remove=False):
+    """ Converts the pickled games of a datasets/iter_* directory to shards, returns the shard paths.
+
+    Game indices continue after those of earlier migrations, so that
+    migrating again never overwrites their shards.
+    """
+    files = os.listdir(directory)
+    migrated = [re.fullmatch(r"migrated_(\d+)" + re.escape(SHARD_SUFFIX), file) for file in files]
+    first_idx = max([int(match.group(1)) + 1 for match in migrated if match], default=0)
+    files = sorted(file for file in files if not file.endswith(SHARD_SUFFIX) and not file.endswith(".tmp"))
+    writer = ShardWriter(directory, "migrated", shard_size)
+    paths = []
+    for idx, file in enumerate(files, first_idx):
+        with open(os.path.join(directory, file), "rb") as f:
+            paths.append(writer.add_game(pickle.load(f, encoding="bytes"), idx))
+    paths = [path for path in paths + [writer.flush()] if path is not None]
+    if remove:
+        for file in files:
+            os.remove(os.path.join(directory, file))
+    logging.info("Migrated %d pickled games of %s to %d shards" % (len(files), directory, len(paths)))
+    return paths
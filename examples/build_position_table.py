@@ -0,0 +1,41 @@
+import sys
+sys.path.append("../")
+
+import torch
+from alphazero import Connect4, BitboardConnect4
+from alphazero import AlphaNet
+from alphazero.mcts.table import build_table
+from argparse import ArgumentParser
+import logging
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s]: %(message)s',
+                    datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--output", type=str, default="./model_data/position_table.bin", help="Table file to write")
+    parser.add_argument("--net", type=str, default=None, help="Checkpoint searched to build the opening book")
+    parser.add_argument("--book_depth", type=int, default=4, help="Plies covered by the opening book")
+    parser.add_argument("--book_reads", type=int, default=777, help="MCTS reads per opening book position")
+    parser.add_argument("--endgame_empty_cells", type=int, default=8,
+                        help="Empty cells below which sampled positions are solved exactly")
+    parser.add_argument("--endgame_games", type=int, default=100, help="Random games sampling endgame positions")
+    parser.add_argument("--MCTS_batch_size", type=int, default=8, help="Number of leaves evaluated per network call")
+    parser.add_argument("--bitboard", action="store_true", help="Use the bitboard Connect4 engine")
+    args = parser.parse_args()
+
+    game_class = BitboardConnect4 if args.bitboard else Connect4
+    net = None
+    if args.net is not None:
+        net = AlphaNet(game_class())
+        net.load_state_dict(torch.load(args.net)['state_dict'])
+        net.eval()
+    with torch.no_grad():
+        build_table(args.output, game_class, net, book_depth=args.book_depth, book_reads=args.book_reads,
+                    endgame_empty_cells=args.endgame_empty_cells, endgame_games=args.endgame_games,
+                    batch_size=args.MCTS_batch_size)
+
+
+if __name__ == "__main__":
+    main()
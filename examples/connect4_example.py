@@ -3,9 +3,10 @@ sys.path.append("../")
 
 from alphazero import learn, evaluate
 from alphazero import run_MCTS
-from alphazero import Connect4
+from alphazero import Connect4, BitboardConnect4
 from alphazero import AlphaNet
 from argparse import ArgumentParser
+import functools
 import logging
 
 logging.basicConfig(format='%(asctime)s [%(levelname)s]: %(message)s',
@@ -30,21 +31,74 @@ def main():
     parser.add_argument("--lr", type=float, default=0.001, help="learning rate")
     parser.add_argument("--gradient_acc_steps", type=int, default=1, help="Number of steps of gradient accumulation")
     parser.add_argument("--max_norm", type=float, default=1.0, help="Clipped gradient norm")
+    parser.add_argument("--fast_train", action="store_true",
+                        help="Train with a compiled bfloat16 step and a loss computed from log-probabilities")
+    parser.add_argument("--no_train_compile", dest="train_compile", action="store_false",
+                        help="Skip torch.compile in --fast_train")
+    parser.add_argument("--no_train_bf16", dest="train_bf16", action="store_false",
+                        help="Keep fp32 in --fast_train")
+    parser.add_argument("--augment_symmetries", action="store_true",
+                        help="Train on randomly mirrored samples")
+    parser.add_argument("--net_profile", type=str, default=None,
+                        help="Width/depth profile of the trained net (tiny, small, standard, large), the game's by default")
+    parser.add_argument("--self_play_profile", type=str, default=None,
+                        help="Run self-play on a net of this profile distilled from the trained net")
+    parser.add_argument("--distill_positions", type=int, default=4096, help="Self-play positions the student is distilled on")
+    parser.add_argument("--distill_iterations", type=int, default=2, help="Latest iterations the distillation positions come from")
+    parser.add_argument("--distill_epochs", type=int, default=10, help="Epochs of distillation per iteration")
+    parser.add_argument("--replay_buffer", action="store_true",
+                        help="Store self-play positions in memory-mapped shards and train on the last replay_window iterations")
+    parser.add_argument("--replay_window", type=int, default=1, help="Self-play iterations the net is trained on")
+    parser.add_argument("--replay_shard_size", type=int, default=4096, help="Positions per replay shard")
+    parser.add_argument("--replay_stream", action="store_true",
+                        help="Stream shuffled pre-collated batches from the replay shards instead of single samples")
+    parser.add_argument("--num_loader_workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--MCTS_batch_size", type=int, default=1, help="Number of leaves evaluated per network call in MCTS")
+    parser.add_argument("--MCTS_virtual_loss", type=float, default=1.0, help="Virtual loss weight spreading batched MCTS leaves")
+    parser.add_argument("--MCTS_transpositions", action="store_true", help="Share MCTS nodes between transposed positions")
+    parser.add_argument("--MCTS_num_threads", type=int, default=1, help="Number of threads searching the same MCTS tree")
+    parser.add_argument("--MCTS_root_workers", type=int, default=1, help="Number of root-parallel MCTS worker processes")
+    parser.add_argument("--MCTS_time_budget", type=float, default=None, help="Wall-clock budget in seconds of every MCTS search")
+    parser.add_argument("--MCTS_early_stop", action="store_true", default=None,
+                        help="Stop MCTS once the best move cannot be overtaken (always on in the arena)")
+    parser.add_argument("--MCTS_cache_size", type=int, default=None, help="Entries of the per-worker NN evaluation cache")
+    parser.add_argument("--MCTS_parallel_games", type=int, default=1,
+                        help="Number of self-play games advanced in lockstep by each MCTS process")
+    parser.add_argument("--MCTS_export_net", action="store_true",
+                        help="Run self-play on the BatchNorm-folded, traced inference export of the net")
+    parser.add_argument("--MCTS_quantize", action="store_true",
+                        help="Run self-play and arena games on an int8 copy of the net (training stays fp32)")
+    parser.add_argument("--quantize_calibration_positions", type=int, default=512,
+                        help="Self-play positions of the latest iterations used to calibrate the int8 net")
+    parser.add_argument("--evaluator_backend", type=str, default="torch", choices=["torch", "onnx"],
+                        help="Run self-play and arena games on the torch net or on its ONNX export with onnxruntime")
+    parser.add_argument("--onnx_num_threads", type=int, default=1, help="onnxruntime threads of every worker")
+    parser.add_argument("--MCTS_inference_server", action="store_true",
+                        help="Evaluate the positions of all MCTS processes in a central batched inference server")
+    parser.add_argument("--inference_max_batch_size", type=int, default=64, help="Largest batch of the inference server")
+    parser.add_argument("--inference_max_wait", type=float, default=0.002,
+                        help="Seconds the inference server waits to fill a batch")
+    parser.add_argument("--bitboard", action="store_true", help="Use the bitboard Connect4 engine")
+    parser.add_argument("--MCTS_position_table", type=str, default=None,
+                        help="Opening book and endgame table built by build_position_table.py")
     args = parser.parse_args()
 
+    game_class = BitboardConnect4 if args.bitboard else Connect4
+    net_class = functools.partial(AlphaNet, profile=args.net_profile)
+
     logging.info("Starting iteration pipeline...")
     for i in range(args.iteration, args.total_iterations):
-        run_MCTS(args, AlphaNet, Connect4, start_idx=0, iteration=i)
-        learn(args, AlphaNet, Connect4, iteration=i, new_optim_state=True)
+        run_MCTS(args, net_class, game_class, start_idx=0, iteration=i)
+        learn(args, net_class, game_class, iteration=i, new_optim_state=True)
         if i >= 1:
-            winner = evaluate(args, i, i + 1, AlphaNet, Connect4)
+            winner = evaluate(args, i, i + 1, net_class, game_class)
             counts = 0
             while winner != (i + 1):
                 logging.info("Trained net didn't perform better, generating more MCTS games for retraining...")
-                run_MCTS(args, AlphaNet, Connect4, start_idx=(counts + 1) * args.num_games_per_MCTS_process, iteration=i)
+                run_MCTS(args, net_class, game_class, start_idx=(counts + 1) * args.num_games_per_MCTS_process, iteration=i)
                 counts += 1
-                learn(args, AlphaNet, Connect4, iteration=i, new_optim_state=True)
-                winner = evaluate(args, i, i + 1, AlphaNet, Connect4)
+                learn(args, net_class, game_class, iteration=i, new_optim_state=True)
+                winner = evaluate(args, i, i + 1, net_class, game_class)
 
 
 if __name__ == "__main__":
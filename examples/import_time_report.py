@@ -0,0 +1,46 @@
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# what the main process and the spawned workers import
+STATEMENTS = ["import alphazero",
+              "from alphazero.mcts.play import self_play",
+              "from alphazero.net.evaluating import fork_process",
+              "from alphazero import Connect4, AlphaNet, learn, evaluate, run_MCTS"]
+
+
+def import_times(statement):
+    """ Runs statement in a fresh interpreter under -X importtime, returns {module: (self us, cumulative us)} """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh interpreters per statement, the best is kept")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level packages listed per statement")
+    args = parser.parse_args()
+
+    for statement in STATEMENTS:
+        runs = [import_times(statement) for i in range(args.repeats)]
+        best = min(runs, key=lambda times: sum(t[0] for t in times.values()))
+        total = sum(t[0] for t in best.values()) / 1e6
+        packages = {}
+        for module, (self_us, cumulative_us) in best.items():
+            package = module.split(".")[0]
+            packages[package] = packages.get(package, 0) + self_us
+        print("%-70s %.3f s" % (statement, total))
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print("    %-30s %.3f s" % (package, self_us / 1e6))
+        print("    pandas/matplotlib loaded: %s" % any(m.split(".")[0] in ("pandas", "matplotlib") for m in best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import sys
+sys.path.append("../")
+
+import torch
+from alphazero import Connect4
+from alphazero import AlphaNet
+from alphazero.net.inference import latency_table
+from alphazero.net.quantization import QuantizedNet, calibration_states
+from alphazero.net.backends import OnnxEvaluator, export_onnx
+from argparse import ArgumentParser
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--net", type=str, default=None, help="Checkpoint to measure (random weights by default)")
+    parser.add_argument("--repeats", type=int, default=30, help="Forward passes timed per batch size")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Compare with the int8 net calibrated on datasets/iter_* instead of the fp32 export")
+    parser.add_argument("--onnx", action="store_true", help="Compare with the onnxruntime evaluator instead")
+    parser.add_argument("--iteration", type=int, default=None, help="Latest self-play iteration to calibrate on")
+    args = parser.parse_args()
+
+    net = AlphaNet(Connect4())
+    if args.net is not None:
+        net.load_state_dict(torch.load(args.net)['state_dict'])
+    net.eval()
+    exported = None
+    if args.quantize:
+        exported = QuantizedNet(net, calibration_states(Connect4, args.iteration))
+        exported.quantize()
+        print("int8 drift: policy KL %.2e, value MSE %.2e" % (exported.drift["policy_kl"], exported.drift["value_mse"]))
+    elif args.onnx:
+        exported = OnnxEvaluator(export_onnx(net, "alphanet.onnx"))
+    name = "int8 [ms]" if args.quantize else "onnx [ms]" if args.onnx else "exported [ms]"
+    print("%6s %12s %15s %8s" % ("batch", "eager [ms]", name, "speedup"))
+    for row in latency_table(net, repeats=args.repeats, exported=exported):
+        print("%6d %12.2f %15.2f %7.2fx" % row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import sys
+sys.path.append("../")
+
+from alphazero.utils.replay import ReplayBuffer, iteration_dirs, migrate_pickles
+from argparse import ArgumentParser
+import logging
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s]: %(message)s', level=logging.INFO)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="./datasets/", help="Directory of the iter_* self-play datasets")
+    parser.add_argument("--shard_size", type=int, default=65536, help="Positions per shard")
+    parser.add_argument("--remove", action="store_true", help="Delete the pickled games once migrated")
+    args = parser.parse_args()
+
+    dirs = iteration_dirs(args.data_dir)
+    for iteration, path in dirs:
+        migrate_pickles(path, args.shard_size, args.remove)
+    if dirs:
+        ReplayBuffer(dirs[-1][0], len(dirs), args.data_dir).report()
+
+
+if __name__ == "__main__":
+    main()
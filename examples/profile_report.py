@@ -0,0 +1,43 @@
+import sys
+sys.path.append("../")
+
+import torch
+from alphazero import Connect4
+from alphazero import AlphaNet
+from alphazero.net.net import MODEL_PROFILES
+from alphazero.net.learning import distill
+from alphazero.net.evaluating import profile_report
+from alphazero.net.quantization import calibration_states
+from argparse import ArgumentParser
+import logging
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s]: %(message)s', level=logging.INFO)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--net", type=str, default=None, help="Teacher checkpoint (random weights by default)")
+    parser.add_argument("--iteration", type=int, default=None, help="Latest self-play iteration to distill on")
+    parser.add_argument("--profiles", type=str, nargs="+", default=["tiny", "small"], choices=list(MODEL_PROFILES))
+    parser.add_argument("--distill_positions", type=int, default=4096, help="Positions the students are distilled on")
+    parser.add_argument("--distill_epochs", type=int, default=10, help="Epochs of distillation")
+    parser.add_argument("--num_games", type=int, default=10, help="Games of every student against the teacher")
+    parser.add_argument("--num_reads", type=int, default=100, help="MCTS reads per move in those games")
+    args = parser.parse_args()
+
+    teacher = AlphaNet(Connect4())
+    if args.net is not None:
+        teacher.load_state_dict(torch.load(args.net)['state_dict'])
+    states = calibration_states(Connect4, args.iteration, args.distill_positions)
+    students = {}
+    for profile in args.profiles:
+        students[profile] = AlphaNet(Connect4(), profile=profile)
+        distill(teacher, students[profile], states, args.distill_epochs)
+
+    print("%10s %12s %15s %10s %10s" % ("profile", "parameters", "positions/s", "policy KL", "score"))
+    for row in profile_report(teacher, students, Connect4, args.num_games, args.num_reads, states=states):
+        print("%10s %12d %15.0f %10.4f %10.2f" % row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import sys
+sys.path.append("../")
+
+import copy
+from argparse import ArgumentParser, Namespace
+import torch
+from alphazero import Connect4
+from alphazero import AlphaNet
+from alphazero.net.learning import training_throughput
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--net_profile", type=str, default=None, help="Width/depth profile of the net")
+    parser.add_argument("--batch_size", type=int, default=32, help="Training batch size")
+    parser.add_argument("--num_batches", type=int, default=20, help="Batches timed per mode")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = AlphaNet(Connect4(), profile=args.net_profile)
+    modes = [("eager fp32", {}),
+             ("fast, no compile", {"fast_train": True, "train_compile": False}),
+             ("fast, fp32", {"fast_train": True, "train_bf16": False}),
+             ("fast", {"fast_train": True})]
+    base = None
+    print("%18s %12s %8s" % ("mode", "samples/s", "speedup"))
+    for name, options in modes:
+        mode_args = Namespace(batch_size=args.batch_size, lr=0.001, max_norm=1.0, gradient_acc_steps=1, **options)
+        samples = training_throughput(copy.deepcopy(net), mode_args, args.num_batches)
+        base = base or samples
+        print("%18s %12.0f %7.2fx" % (name, samples, samples / base))
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,9 @@ CLASSIFIERS = ['Intended Audience :: Science/Research',
                'Programming Language :: Python :: 3.6',
                'Programming Language :: Python :: 3.7']
 EXTRAS_REQUIRE = {
+    'onnx': [
+        'onnx',
+        'onnxruntime'],
     'tests': [
         'pytest',
         'pytest-cov'],